@@ -0,0 +1,172 @@
+import os
+import time
+import threading
+from typing import Callable, Optional
+from cookie import BilibiliQRLogin, COOKIES_DIR, COOKIE_FILE, LEGACY_REFRESH_TOKEN_SUFFIX
+
+ACCOUNTS_DIR = os.path.join(COOKIES_DIR, "accounts")
+
+# 风控/限流相关的返回码: -352 风控校验失败, -412 请求被拦截, -509 请求过于频繁, -799 请求过于频繁
+RISK_CONTROL_CODES = {-352, -412, -509, -799}
+RISK_CONTROL_STATUS = {412, 429}
+
+BENCH_SECONDS = 300
+MAX_BENCH_SECONDS = 3600
+
+STRATEGIES = ("round_robin", "least_throttled")
+
+
+def _is_cookie_file(filename: str) -> bool:
+    # 旧版本把refresh_token保存为<账号名>_refresh_token.txt, 不是Cookie文件
+    return filename.endswith(".txt") and not filename.endswith(LEGACY_REFRESH_TOKEN_SUFFIX)
+
+
+class Account:
+    def __init__(self, name: str, cookie_file: str, log: Callable = print):
+        self.name = name
+        self.login = BilibiliQRLogin(cookie_file, log)
+        self.session = self.login.session
+        self.uname: str = ""
+        self.logged_in = False
+        self.checked = False
+        self.premium = False
+        self.benched_until = 0.0
+        self.last_throttled = 0.0
+        self.throttle_count = 0
+        self.requests = 0
+
+    def healthy(self, now: float) -> bool:
+        return self.logged_in and self.benched_until <= now
+
+    def check(self) -> bool:
+        self.logged_in = self.login.is_logged_in()
+        nav = self.login.nav_data
+        self.uname = nav.get("uname", "")
+        self.premium = self.logged_in and nav.get("vipStatus") == 1
+        self.checked = True
+        return self.logged_in
+
+
+class AccountPool:
+    """多账号池: 按轮询或最久未被限流的顺序分配账号, 触发风控的账号暂时停用"""
+
+    def __init__(self, accounts_dir: str = ACCOUNTS_DIR, strategy: str = "round_robin", include_default: bool = True,
+                 log: Optional[Callable] = None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"未知的账号分配策略: {strategy}")
+        self.accounts_dir = accounts_dir
+        self.strategy = strategy
+        self.log = log or print
+        self.accounts: list[Account] = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+        os.makedirs(accounts_dir, exist_ok=True)
+        if include_default and os.path.exists(COOKIE_FILE):
+            self.accounts.append(Account("default", COOKIE_FILE, self.log))
+        for filename in sorted(os.listdir(accounts_dir)):
+            if _is_cookie_file(filename):
+                self.accounts.append(Account(filename[:-4], os.path.join(accounts_dir, filename), self.log))
+
+    @classmethod
+    def load_if_configured(cls, accounts_dir: str = ACCOUNTS_DIR, log: Optional[Callable] = None) -> Optional["AccountPool"]:
+        """只有存储了额外账号时才启用账号池"""
+        if not os.path.isdir(accounts_dir) or not any(_is_cookie_file(f) for f in os.listdir(accounts_dir)):
+            return None
+        return cls(accounts_dir, log=log)
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def add_account(self, name: str) -> bool:
+        """通过扫码登录新增一个账号"""
+        if any(account.name == name for account in self.accounts):
+            self.log(f"账号 {name} 已存在")
+            return False
+        account = Account(name, os.path.join(self.accounts_dir, f"{name}.txt"), self.log)
+        if not account.login.qr_login():
+            return False
+        account.check()
+        with self._lock:
+            self.accounts.append(account)
+        return True
+
+    def check(self) -> int:
+        """检查所有账号的登录状态和大会员状态, 返回可用账号数"""
+        for account in self.accounts:
+            self.log(f"检查账号 {account.name}...")
+            account.check()
+        return sum(account.logged_in for account in self.accounts)
+
+    def _check_unchecked(self) -> None:
+        """第一次分配账号前检查尚未检查过的账号, 调用方不需要先手动调用check()"""
+        if all(account.checked for account in self.accounts):
+            return
+        with self._check_lock:
+            for account in self.accounts:
+                if not account.checked:
+                    account.check()
+
+    def acquire(self, premium: bool = False) -> Optional[Account]:
+        """premium=True 时优先使用大会员账号; 否则优先使用普通账号, 把大会员账号留给高画质请求"""
+        self._check_unchecked()
+        now = time.time()
+        with self._lock:
+            healthy = [account for account in self.accounts if account.healthy(now)]
+            if not healthy:
+                return None
+            preferred = [account for account in healthy if account.premium == premium]
+            candidates = preferred or healthy
+            if self.strategy == "least_throttled":
+                account = min(candidates, key=lambda a: (a.last_throttled, a.requests))
+            else:
+                account = candidates[self._next % len(candidates)]
+                self._next += 1
+            account.requests += 1
+            return account
+
+    def bench(self, account: Account) -> None:
+        with self._lock:
+            account.throttle_count += 1
+            account.last_throttled = time.time()
+            seconds = min(MAX_BENCH_SECONDS, BENCH_SECONDS * 2 ** (account.throttle_count - 1))
+            account.benched_until = account.last_throttled + seconds
+        self.log(f"账号 {account.name} 触发风控，暂停使用 {seconds} 秒")
+
+    def is_risk_response(self, response) -> bool:
+        if response.status_code in RISK_CONTROL_STATUS:
+            return True
+        if "json" not in response.headers.get("content-type", ""):
+            return False
+        try:
+            return response.json().get("code") in RISK_CONTROL_CODES
+        except ValueError:
+            return False
+
+    def get(self, url: str, premium: bool = False, **kwargs):
+        """用池中的账号发起GET请求, 遇到风控自动停用该账号并换号重试"""
+        for _ in range(max(1, len(self.accounts))):
+            account = self.acquire(premium)
+            if account is None:
+                break
+            account.login.reload_if_changed()
+            response = account.session.get(url, **kwargs)
+            if not self.is_risk_response(response):
+                return response
+            self.bench(account)
+        raise RuntimeError("账号池中没有可用账号")
+
+    def show(self) -> None:
+        now = time.time()
+        print("\n====== 账号池 ======")
+        print(f"分配策略: {self.strategy}")
+        for account in self.accounts:
+            if not account.logged_in:
+                status = "未登录"
+            elif account.benched_until > now:
+                status = f"风控停用中(剩余{int(account.benched_until - now)}秒)"
+            else:
+                status = "可用"
+            vip = "大会员" if account.premium else "普通"
+            print(f"{account.name}: {account.uname or '-'} [{vip}] {status} 请求数: {account.requests} 风控次数: {account.throttle_count}")
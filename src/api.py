@@ -0,0 +1,250 @@
+"""供其他程序直接调用的接口, 不需要input()交互, 也不向终端输出
+
+    from api import resolve, download, fetch_comments, CancelToken
+
+    token = CancelToken()
+    for job in resolve("BV1xx411c7mD", max_quality=80):
+        result = download(job, on_progress=lambda e: print(e.downloaded, e.total), cancel_token=token)
+
+    for comment in fetch_comments("BV1xx411c7mD", max_pages=3):
+        print(comment.uname, comment.message)
+"""
+import time
+import threading
+from typing import Callable, Iterator, Optional
+from video_download import BiliVideoDownloader, DownloadCancelled, DOWNLOADS_DIR
+from comments import BiliCommentsFetcher
+from comment_records import CommentRecord, parse_comment_page
+from quality_policy import QualityPolicy
+from account_pool import AccountPool
+
+PROGRESS_INTERVAL = 0.5
+
+
+def _quiet(*args, **kwargs) -> None:
+    pass
+
+
+class CancelToken:
+    """可在其他线程调用cancel(), 正在进行的下载会在下一个数据块时停止"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise DownloadCancelled()
+
+
+class DownloadJob:
+    """resolve()得到的一个分P的下载任务"""
+
+    __slots__ = ("bvid", "title", "page_index", "page_title", "cid", "quality", "format", "size", "url", "headers",
+                 "video_data")
+
+    def __init__(self, video_data: dict, info: dict):
+        self.video_data = video_data
+        self.bvid: str = video_data["bvid"]
+        self.title: str = video_data["title"]
+        self.page_index: int = info["page_index"]
+        self.page_title: str = info["page_title"]
+        self.cid = video_data["pages"][info["page_index"]]["cid"]
+        self.quality: str = info["quality"]
+        self.format: str = info["format"]
+        self.size: int = int(info.get("size") or 0)
+        self.url: str = info["url"]
+        self.headers: dict = info["header"]
+
+    def to_info(self) -> dict:
+        return {
+            "url": self.url,
+            "size": self.size,
+            "quality": self.quality,
+            "format": self.format,
+            "page_index": self.page_index,
+            "header": self.headers,
+            "page_title": self.page_title,
+        }
+
+    def __repr__(self) -> str:
+        return f"DownloadJob(bvid={self.bvid!r}, page={self.page_index + 1}, quality={self.quality}, size={self.size})"
+
+
+class ProgressEvent:
+    """state: started / downloading / finished / cancelled / failed"""
+
+    __slots__ = ("job", "state", "downloaded", "total", "speed", "elapsed")
+
+    def __init__(self, job: DownloadJob, state: str, downloaded: int, total: int, speed: float, elapsed: float):
+        self.job = job
+        self.state = state
+        self.downloaded = downloaded
+        self.total = total
+        self.speed = speed
+        self.elapsed = elapsed
+
+    @property
+    def fraction(self) -> Optional[float]:
+        return self.downloaded / self.total if self.total else None
+
+    @property
+    def eta(self) -> Optional[float]:
+        if not self.total or not self.speed:
+            return None
+        return max(0, self.total - self.downloaded) / self.speed
+
+    def __repr__(self) -> str:
+        return f"ProgressEvent({self.state}, {self.downloaded}/{self.total}, {self.speed / 1024 / 1024:.2f}MB/s)"
+
+
+class _ProgressReporter:
+    """代替tqdm传给下载循环: 按固定间隔回调进度, 并在每个数据块检查是否已取消"""
+
+    def __init__(self, job: DownloadJob, on_progress: Optional[Callable], cancel_token: Optional[CancelToken],
+                 interval: float):
+        self.job = job
+        self.on_progress = on_progress
+        self.cancel_token = cancel_token
+        self.interval = interval
+        self.downloaded = 0
+        self.started = time.monotonic()
+        self._last_time = self.started
+        self._last_bytes = 0
+
+    def emit(self, state: str) -> None:
+        now = time.monotonic()
+        elapsed = now - self.started
+        if state == "downloading":
+            speed = (self.downloaded - self._last_bytes) / max(now - self._last_time, 1e-6)
+        else:
+            speed = self.downloaded / elapsed if elapsed > 0 else 0.0
+        self._last_time, self._last_bytes = now, self.downloaded
+        if self.on_progress is not None:
+            self.on_progress(ProgressEvent(self.job, state, self.downloaded, self.job.size, speed, elapsed))
+
+    def update(self, n: int) -> None:
+        self.downloaded += n
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        if time.monotonic() - self._last_time >= self.interval:
+            self.emit("downloading")
+
+    def __enter__(self):
+        self.emit("started")
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class BiliClient:
+    """持有独立的会话, 多线程使用时每个线程一个实例"""
+
+    def __init__(self, account_pool: Optional[AccountPool] = None, max_quality: Optional[int] = None,
+                 remux_flv: bool = False, log: Optional[Callable] = None):
+        log = log or _quiet
+        self.downloader = BiliVideoDownloader(account_pool, QualityPolicy(max_quality=max_quality), remux_flv, log=log)
+        self.fetcher = BiliCommentsFetcher(log=log)
+
+    def resolve(self, bv: str, pages: Optional[list[int]] = None) -> list[DownloadJob]:
+        """获取视频信息并为每个分P(页码从1开始, 默认全部)自动选择画质和下载地址"""
+        bv_param = self.downloader._bv_parser(bv)
+        if not bv_param:
+            raise ValueError(f"无法识别的BV/URL: {bv}")
+        self.downloader._reload_cookies_if_changed()
+        video_data = self.downloader._video_data_get(bv_param)
+        if not video_data:
+            raise RuntimeError(f"获取视频信息失败: {bv}")
+        page_indexes = [p - 1 for p in pages] if pages else list(range(len(video_data["pages"])))
+        for page_index in page_indexes:
+            if not 0 <= page_index < len(video_data["pages"]):
+                raise ValueError(f"分P序号{page_index + 1}不存在")
+        self.downloader.quality_policy.plan([video_data["pages"][i].get("duration", 0) for i in page_indexes])
+        jobs = []
+        for page_index in page_indexes:
+            info = self.downloader._resolve_page(video_data, bv_param, page_index)
+            if info:
+                jobs.append(DownloadJob(video_data, info))
+        if not jobs:
+            raise RuntimeError(f"获取下载链接失败: {bv}")
+        return jobs
+
+    def download(self, job: DownloadJob, output_dir: str = DOWNLOADS_DIR, on_progress: Optional[Callable] = None,
+                 cancel_token: Optional[CancelToken] = None, interval: float = PROGRESS_INTERVAL) -> dict:
+        """下载一个分P, 返回校验结果和文件路径; 取消时删除未完成的文件并抛出DownloadCancelled"""
+        reporter = _ProgressReporter(job, on_progress, cancel_token, interval)
+        try:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            result = self.downloader._download_page(job.video_data, job.to_info(), output_dir, reporter)
+        except DownloadCancelled:
+            reporter.emit("cancelled")
+            raise
+        except Exception:
+            reporter.emit("failed")
+            raise
+        reporter.emit("finished" if result["status"] in ("ok", "unverified") else "failed")
+        return result
+
+    def fetch_comments(self, oid: str, sort: int = 1, page_size: int = 20, max_pages: Optional[int] = None,
+                       include_hots: bool = False) -> Iterator[CommentRecord]:
+        """逐页请求并逐条返回评论; oid可以是av号数字、BV号或视频链接"""
+        oid = str(oid)
+        if not oid.isdigit():
+            bv_param = self.fetcher._bv_parser(oid)
+            if not bv_param:
+                raise ValueError(f"无法识别的BV/URL: {oid}")
+            oid, _ = self.fetcher._get_video_aid(bv_param)
+            if not oid:
+                raise RuntimeError("获取视频AID失败")
+
+        page_num, total_pages = 1, 1
+        while page_num <= total_pages and (max_pages is None or page_num <= max_pages):
+            comments = self.fetcher._get_comments(oid=oid, page=page_num, page_size=page_size, sort=sort)
+            page = parse_comment_page(comments)
+            if not page.ok:
+                raise RuntimeError(f"获取第 {page_num} 页评论失败: {page.message or '请求失败'}")
+            if page_num == 1:
+                total_pages = self.fetcher._get_page_count(comments, page_size)
+                if page.top is not None:
+                    yield page.top
+                if include_hots:
+                    yield from page.hots
+            yield from page.replies
+            page_num += 1
+
+
+_local = threading.local()
+
+
+def _client() -> BiliClient:
+    """模块级函数使用的默认实例, 每个线程一个, 避免多个线程共用一个requests会话"""
+    if not hasattr(_local, "client"):
+        pool = AccountPool.load_if_configured(log=_quiet)
+        if pool is not None and not pool.check():
+            pool = None  # 账号池中没有已登录的账号时使用默认会话
+        _local.client = BiliClient(pool)
+    return _local.client
+
+
+def resolve(bv: str, pages: Optional[list[int]] = None, max_quality: Optional[int] = None) -> list[DownloadJob]:
+    client = _client()
+    client.downloader.quality_policy = QualityPolicy(max_quality=max_quality)
+    return client.resolve(bv, pages)
+
+
+def download(job: DownloadJob, output_dir: str = DOWNLOADS_DIR, on_progress: Optional[Callable] = None,
+             cancel_token: Optional[CancelToken] = None, interval: float = PROGRESS_INTERVAL) -> dict:
+    return _client().download(job, output_dir, on_progress, cancel_token, interval)
+
+
+def fetch_comments(oid: str, sort: int = 1, page_size: int = 20, max_pages: Optional[int] = None,
+                   include_hots: bool = False) -> Iterator[CommentRecord]:
+    return _client().fetch_comments(oid, sort, page_size, max_pages, include_hots)
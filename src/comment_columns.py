@@ -0,0 +1,231 @@
+import os
+import json
+import datetime
+from array import array
+from typing import Optional
+from comment_records import CommentRecord, CommentPage
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖: pip install .[analytics]
+    np = None
+
+COLUMNS_VERSION = 1
+
+# 定长列: 列名 -> (array typecode, numpy dtype)
+INT_COLUMNS = {
+    "rpid": ("q", "<i8"),
+    "mid": ("q", "<i8"),
+    "ctime": ("q", "<i8"),
+    "like": ("q", "<i8"),
+    "rcount": ("q", "<i8"),
+    "uname_id": ("q", "<i4"),
+}
+
+TEXT_FILE = "text.bin"
+TEXT_OFFSETS = "text_offsets"
+UNAME_FILE = "unames.bin"
+UNAME_OFFSETS = "uname_offsets"
+META_FILE = "meta.json"
+
+
+def _local_utc_offset() -> int:
+    offset = datetime.datetime.now().astimezone().utcoffset()
+    return int(offset.total_seconds()) if offset else 0
+
+
+class CommentColumnsBuilder:
+    """把逐页获取的评论数据累积为紧凑的列式数组"""
+
+    def __init__(self):
+        self.columns: dict[str, array] = {name: array(code) for name, (code, _) in INT_COLUMNS.items()}
+        self.text = bytearray()
+        self.text_offsets = array("q", [0])
+        self.unames: dict[str, int] = {}
+        self._seen: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.columns["rpid"])
+
+    def _intern_uname(self, uname: str) -> int:
+        uname_id = self.unames.get(uname)
+        if uname_id is None:
+            uname_id = len(self.unames)
+            self.unames[uname] = uname_id
+        return uname_id
+
+    def add_record(self, record: CommentRecord) -> None:
+        if record.rpid in self._seen:
+            return
+        self._seen.add(record.rpid)
+
+        cols = self.columns
+        cols["rpid"].append(record.rpid)
+        cols["mid"].append(record.mid)
+        cols["ctime"].append(record.ctime)
+        cols["like"].append(record.like)
+        cols["rcount"].append(record.rcount)
+        cols["uname_id"].append(self._intern_uname(record.uname))
+
+        self.text += record.message.encode("utf-8")
+        self.text_offsets.append(len(self.text))
+
+    def add_page(self, page: CommentPage) -> None:
+        """添加一页解析后的评论 (置顶 + 普通评论)"""
+        if not page.ok:
+            return
+        if page.top:
+            self.add_record(page.top)
+        for record in page.replies:
+            self.add_record(record)
+
+    def save(self, path: str) -> Optional["CommentColumns"]:
+        """写出为可mmap的列式目录, 每列一个.npy文件"""
+        if np is None:
+            print("未安装numpy，跳过列式导出 (pip install .[analytics])")
+            return None
+
+        os.makedirs(path, exist_ok=True)
+        for name, (_, dtype) in INT_COLUMNS.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.frombuffer(self.columns[name], dtype=self.columns[name].typecode).astype(dtype))
+        np.save(os.path.join(path, f"{TEXT_OFFSETS}.npy"), np.frombuffer(self.text_offsets, dtype="q").astype("<i8"))
+        with open(os.path.join(path, TEXT_FILE), "wb") as f:
+            f.write(self.text)
+
+        uname_blob = bytearray()
+        uname_offsets = array("q", [0])
+        for uname in self.unames:  # dict保持插入顺序, 即uname_id顺序
+            uname_blob += uname.encode("utf-8")
+            uname_offsets.append(len(uname_blob))
+        np.save(os.path.join(path, f"{UNAME_OFFSETS}.npy"), np.frombuffer(uname_offsets, dtype="q").astype("<i8"))
+        with open(os.path.join(path, UNAME_FILE), "wb") as f:
+            f.write(uname_blob)
+
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": COLUMNS_VERSION, "count": len(self), "unames": len(self.unames)}, f)
+
+        print(f"列式评论数据已保存到 {path} (共 {len(self)} 条)")
+        return CommentColumns.load(path)
+
+
+class CommentColumns:
+    """列式评论数据, 所有统计均为numpy向量化计算"""
+
+    def __init__(self, path: str, columns: dict, text, text_offsets, unames, uname_offsets):
+        self.path = path
+        self.rpid = columns["rpid"]
+        self.mid = columns["mid"]
+        self.ctime = columns["ctime"]
+        self.like = columns["like"]
+        self.rcount = columns["rcount"]
+        self.uname_id = columns["uname_id"]
+        self.text = text
+        self.text_offsets = text_offsets
+        self.unames = unames
+        self.uname_offsets = uname_offsets
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CommentColumns":
+        if np is None:
+            raise RuntimeError("读取列式评论数据需要numpy")
+        mode = "r" if mmap else None
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in INT_COLUMNS}
+
+        def blob(filename: str):
+            filepath = os.path.join(path, filename)
+            if os.path.getsize(filepath) == 0:
+                return np.zeros(0, dtype=np.uint8)
+            if mmap:
+                return np.memmap(filepath, dtype=np.uint8, mode="r")
+            return np.fromfile(filepath, dtype=np.uint8)
+
+        return cls(
+            path,
+            columns,
+            blob(TEXT_FILE),
+            np.load(os.path.join(path, f"{TEXT_OFFSETS}.npy"), mmap_mode=mode),
+            blob(UNAME_FILE),
+            np.load(os.path.join(path, f"{UNAME_OFFSETS}.npy"), mmap_mode=mode),
+        )
+
+    def __len__(self) -> int:
+        return int(self.rpid.shape[0])
+
+    def message(self, index: int) -> str:
+        start, end = self.text_offsets[index], self.text_offsets[index + 1]
+        return bytes(self.text[start:end]).decode("utf-8")
+
+    def uname(self, uname_id: int) -> str:
+        start, end = self.uname_offsets[uname_id], self.uname_offsets[uname_id + 1]
+        return bytes(self.unames[start:end]).decode("utf-8")
+
+    def likes_distribution(self) -> dict:
+        """点赞数分布: 分位数 + 以2的幂为边界的直方图"""
+        if len(self) == 0:
+            return {"count": 0}
+        likes = np.asarray(self.like)
+        top = int(likes.max())
+        edges = np.concatenate(([0, 1], 2 ** np.arange(1, max(1, int(np.ceil(np.log2(top + 1)))) + 1)))
+        counts, edges = np.histogram(likes, bins=edges)
+        p50, p90, p99 = np.percentile(likes, [50, 90, 99])
+        return {
+            "count": len(self),
+            "total": int(likes.sum()),
+            "mean": float(likes.mean()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": top,
+            "histogram": [(int(lo), int(hi), int(c)) for lo, hi, c in zip(edges[:-1], edges[1:], counts)],
+        }
+
+    def hourly_activity(self, utc_offset: Optional[int] = None) -> "np.ndarray":
+        """按一天中的小时统计评论数, 默认使用本机时区"""
+        if utc_offset is None:
+            utc_offset = _local_utc_offset()
+        hours = ((np.asarray(self.ctime) + utc_offset) // 3600) % 24
+        return np.bincount(hours, minlength=24)
+
+    def top_commenters(self, n: int = 10) -> list[dict]:
+        """按评论数排序的活跃用户, 附带获赞总数"""
+        if len(self) == 0:
+            return []
+        mids, first_index, inverse, counts = np.unique(
+            np.asarray(self.mid), return_index=True, return_inverse=True, return_counts=True
+        )
+        likes = np.bincount(inverse, weights=np.asarray(self.like), minlength=mids.shape[0])
+        order = np.lexsort((-likes, -counts))[:n]
+        uname_ids = np.asarray(self.uname_id)[first_index[order]]
+        return [
+            {"mid": int(mids[i]), "uname": self.uname(int(u)), "comments": int(counts[i]), "likes": int(likes[i])}
+            for i, u in zip(order, uname_ids)
+        ]
+
+    def print_summary(self, top_n: int = 10) -> None:
+        dist = self.likes_distribution()
+        print("====== 评论统计 ======")
+        print(f"评论数: {dist['count']}")
+        if not dist["count"]:
+            return
+        print(f"总点赞: {dist['total']}  平均: {dist['mean']:.2f}  中位数: {dist['p50']:.0f}  P90: {dist['p90']:.0f}  P99: {dist['p99']:.0f}  最高: {dist['max']}")
+        print("点赞分布:")
+        for lo, hi, count in dist["histogram"]:
+            if count:
+                print(f"  [{lo}, {hi}): {count}")
+        print("各小时评论数:")
+        hourly = self.hourly_activity()
+        peak = max(1, int(hourly.max()))
+        for hour, count in enumerate(hourly):
+            print(f"  {hour:02d}时 {'#' * (int(count) * 40 // peak)} {int(count)}")
+        print(f"评论最多的用户 (前{top_n}):")
+        for i, user in enumerate(self.top_commenters(top_n), 1):
+            print(f"  {i}. {user['uname']} (mid={user['mid']}): {user['comments']} 条, 👍 {user['likes']}")
+
+
+def main():
+    path = input("请输入列式评论目录: ").strip()
+    CommentColumns.load(path).print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+
+class CommentRecord:
+    """单条评论的紧凑表示, 只保留导出用到的字段"""
+
+    __slots__ = ("rpid", "mid", "uname", "message", "like", "rcount", "ctime")
+
+    def __init__(self, rpid: int, mid: int, uname: str, message: str, like: int, rcount: int, ctime: int):
+        self.rpid = rpid
+        self.mid = mid
+        self.uname = uname
+        self.message = message
+        self.like = like
+        self.rcount = rcount
+        self.ctime = ctime
+
+    @classmethod
+    def from_reply(cls, reply: dict) -> "CommentRecord":
+        member = reply.get("member") or {}
+        return cls(
+            int(reply.get("rpid", 0)),
+            int(reply.get("mid") or member.get("mid") or 0),
+            sys.intern(member.get("uname", "")),
+            (reply.get("content") or {}).get("message", ""),
+            int(reply.get("like", 0)),
+            int(reply.get("rcount", 0)),
+            int(reply.get("ctime", 0)),
+        )
+
+    def __repr__(self) -> str:
+        return f"CommentRecord(rpid={self.rpid}, uname={self.uname!r}, like={self.like})"
+
+
+class CommentPage:
+    """一页 x/v2/reply 响应解析后的结果, 原始响应可随即释放"""
+
+    __slots__ = ("code", "message", "num", "count", "acount", "top", "hots", "replies")
+
+    def __init__(self, code: int, message: str = "", num: int = 1, count: int = 0, acount: int = 0,
+                 top: Optional[CommentRecord] = None, hots: Optional[list] = None, replies: Optional[list] = None):
+        self.code = code
+        self.message = message
+        self.num = num
+        self.count = count
+        self.acount = acount
+        self.top = top
+        self.hots: list[CommentRecord] = hots or []
+        self.replies: list[CommentRecord] = replies or []
+
+    @property
+    def ok(self) -> bool:
+        return self.code == 0
+
+    def __len__(self) -> int:
+        return len(self.replies)
+
+
+def parse_comment_page(comments_data: dict) -> CommentPage:
+    if comments_data.get("code") != 0:
+        return CommentPage(comments_data.get("code", -1), comments_data.get("message", "未知错误"))
+
+    data = comments_data.get("data") or {}
+    page_info = data.get("page") or {}
+    top = (data.get("upper") or {}).get("top")
+    return CommentPage(
+        0,
+        num=page_info.get("num", 1),
+        count=page_info.get("count", 0),
+        acount=page_info.get("acount", 0),
+        top=CommentRecord.from_reply(top) if top else None,
+        hots=[CommentRecord.from_reply(r) for r in data.get("hots") or []],
+        replies=[CommentRecord.from_reply(r) for r in data.get("replies") or []],
+    )
+
+
+def _fake_reply(i: int) -> dict:
+    """构造与接口返回结构相近的评论, 用于内存测量"""
+    mid = i % 5000
+    return {
+        "rpid": 100000000 + i, "oid": 1, "type": 1, "mid": mid, "root": 0, "parent": 0, "dialog": 0,
+        "count": 0, "rcount": i % 7, "state": 0, "fansgrade": 0, "attr": 0, "ctime": 1700000000 + i,
+        "like": i % 997, "action": 0,
+        "member": {
+            "mid": str(mid), "uname": f"用户{mid}", "sex": "保密", "sign": "这个人很懒", "avatar": f"https://i0.hdslb.com/bfs/face/{mid}.jpg",
+            "rank": "10000", "level_info": {"current_level": 5, "current_min": 0, "current_exp": 0, "next_exp": 0},
+            "pendant": {"pid": 0, "name": "", "image": "", "expire": 0},
+            "nameplate": {"nid": 0, "name": "", "image": "", "image_small": "", "level": "", "condition": ""},
+            "official_verify": {"type": -1, "desc": ""}, "vip": {"vipType": 0, "vipDueDate": 0, "vipStatus": 0},
+        },
+        "content": {"message": f"第{i}条评论内容", "members": [], "emote": {}, "jump_url": {}, "max_line": 6},
+        "replies": None,
+        "reply_control": {"sub_reply_entry_text": "", "sub_reply_title_text": "", "time_desc": "1天前发布", "location": "IP属地：上海"},
+    }
+
+
+def measure_memory(count: int = 100000) -> tuple[int, int]:
+    """分别测量持有原始响应和紧凑记录时的内存峰值(字节)"""
+    tracemalloc.start()
+    raw = [_fake_reply(i) for i in range(count)]
+    _, raw_peak = tracemalloc.get_traced_memory()
+    del raw
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    records = []
+    for i in range(count):  # 逐条解析后立即丢弃原始数据, 与逐页处理时一致
+        records.append(CommentRecord.from_reply(_fake_reply(i)))
+    _, compact_peak = tracemalloc.get_traced_memory()
+    del records
+    tracemalloc.stop()
+    return raw_peak, compact_peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    start = time.time()
+    raw_peak, compact_peak = measure_memory(count)
+    print(f"评论数: {count}")
+    print(f"原始响应内存峰值: {raw_peak / 1024 / 1024:.1f} MiB ({raw_peak / count:.0f} B/条)")
+    print(f"紧凑记录内存峰值: {compact_peak / 1024 / 1024:.1f} MiB ({compact_peak / count:.0f} B/条)")
+    print(f"耗时: {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,12 @@ from http.cookiejar import LWPCookieJar
 import requests
 from tqdm import tqdm
 import json
+from wbi import wbi_signer
 import datetime
+from typing import Callable, Optional
+from comment_columns import CommentColumnsBuilder
+from comment_records import CommentPage, parse_comment_page
+from profiling import NullProfiler
 
 COOKIES_DIR = "cookies"
 COOKIE_FILE = os.path.join(COOKIES_DIR, "bilibili_cookies.txt")
@@ -18,21 +23,30 @@ HEADERS = {
 DOWNLOADS_DIR = "bilibili_downloads"
 
 class BiliCommentsFetcher:
-    def __init__(self):
+    def __init__(self, log: Optional[Callable] = None):
         self.session = requests.Session()
         self.cookie_jar = LWPCookieJar(COOKIE_FILE)
+        self._cookie_mtime = 0.0
+        self.profiler = NullProfiler()
+        self.log = log or print  # 作为库调用时可传入日志函数或静默
         self._load_cookies()
         
     def _load_cookies(self):
         os.makedirs(COOKIES_DIR, exist_ok=True)
         if os.path.exists(COOKIE_FILE):
             try:
+                self._cookie_mtime = os.path.getmtime(COOKIE_FILE)
                 self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
                 for cookie in self.cookie_jar:
                     self.session.cookies.set_cookie(cookie)
-                print("检测到已保存的Cookie文件，已加载登录状态")
+                self.log("检测到已保存的Cookie文件，已加载登录状态")
             except Exception as e:
-                print(f"加载Cookie文件出错: {e}")
+                self.log(f"加载Cookie文件出错: {e}")
+    
+    def _reload_cookies_if_changed(self):
+        """Cookie文件被后台刷新后重新加载, 无需重启"""
+        if os.path.exists(COOKIE_FILE) and os.path.getmtime(COOKIE_FILE) != self._cookie_mtime:
+            self._load_cookies()
                 
     def is_logged_in(self) -> bool:
         try:
@@ -42,6 +56,7 @@ class BiliCommentsFetcher:
                 timeout=10
             )
             data = response.json()
+            wbi_signer.update_from_nav(data, self.log)
             if data.get("code") == 0 and data.get("data", {}).get("isLogin"):
                 print(f"登录状态有效! 用户名: {data['data']['uname']}")
                 return True
@@ -70,11 +85,11 @@ class BiliCommentsFetcher:
             raw_response.raise_for_status()
             data = raw_response.json().get("data", {})
             if not data:
-                print("获取视频数据失败")
+                self.log("获取视频数据失败")
                 return "", ""
             return str(data.get("aid", "")), data.get("title", "无标题")
         except Exception as e:
-            print(f"请求视频信息失败: {e}")
+            self.log(f"请求视频信息失败: {e}")
             return "", ""
         
     def _get_comments(self, oid: str, page: int, page_size: int, sort: int) -> dict:
@@ -96,7 +111,7 @@ class BiliCommentsFetcher:
             response.raise_for_status()
             return response.json()  
         except Exception as e:
-            print(f"请求评论数据失败: {e}")
+            self.log(f"请求评论数据失败: {e}")
             return {}
         
     def save_comments_to_json(self, comments: dict, filename: str):
@@ -108,12 +123,12 @@ class BiliCommentsFetcher:
         except Exception as e:
             print(f"保存评论数据失败: {e}")
             
-    def save_comments_to_txt(self, comments_data: dict, filename: str):
+    def save_comments_to_txt(self, page: CommentPage, filename: str):
         
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         
-        if comments_data.get("code") != 0:
-            error_msg = f"错误: {comments_data.get('message', '未知错误')}"
+        if not page.ok:
+            error_msg = f"错误: {page.message}"
             try:
                 with open(filename, "w", encoding="utf-8") as f:
                     f.write(error_msg)
@@ -122,40 +137,32 @@ class BiliCommentsFetcher:
                 print(f"保存评论错误信息失败: {e}")
             return
             
-        data = comments_data.get("data", {})
-        
         output_lines = []
-        current_page = data.get("page", {}).get("num", 1)
-        
-        page_info = data.get("page", {})
-        output_lines.append(f"====== 评论信息 (第 {current_page} 页) ======")
-        output_lines.append(f"页码: {current_page}/{page_info.get('count', 1)}")
-        output_lines.append(f"总计评论数: {page_info.get('acount', 0)}")
-        output_lines.append(f"根评论数: {page_info.get('count', 0)}")
+        output_lines.append(f"====== 评论信息 (第 {page.num} 页) ======")
+        output_lines.append(f"页码: {page.num}/{page.count}")
+        output_lines.append(f"总计评论数: {page.acount}")
+        output_lines.append(f"根评论数: {page.count}")
         output_lines.append("")
          
-        upper = data.get("upper", {})
-        if upper and upper.get("top"):
-            top_comment = upper["top"]
+        if page.top:
+            top_comment = page.top
             output_lines.append(f"====== 置顶评论 ======")
-            output_lines.append(f"用户: {top_comment['member']['uname']}")
-            output_lines.append(f"内容: {top_comment['content']['message']}")
-            output_lines.append(f"点赞数: {top_comment['like']}")
-            output_lines.append(f"时间: {self._format_time(top_comment['ctime'])}")
+            output_lines.append(f"用户: {top_comment.uname}")
+            output_lines.append(f"内容: {top_comment.message}")
+            output_lines.append(f"点赞数: {top_comment.like}")
+            output_lines.append(f"时间: {self._format_time(top_comment.ctime)}")
             output_lines.append("")
         
-        hots = data.get("hots", [])
-        if hots:
+        if page.hots:
             output_lines.append("====== 热门评论 ======")
-            for i, hot in enumerate(hots, 1):
-                output_lines.append(f"{i}. {hot['member']['uname']}: {hot['content']['message']} (👍 {hot['like']})")
+            for i, hot in enumerate(page.hots, 1):
+                output_lines.append(f"{i}. {hot.uname}: {hot.message} (👍 {hot.like})")
             output_lines.append("")
         
-        replies = data.get("replies", [])
-        if replies:
+        if page.replies:
             output_lines.append("====== 普通评论 ======")
-            for i, reply in enumerate(replies, 1):
-                output_lines.append(f"{i}. {reply['member']['uname']}: {reply['content']['message']} (👍 {reply['like']})")
+            for i, reply in enumerate(page.replies, 1):
+                output_lines.append(f"{i}. {reply.uname}: {reply.message} (👍 {reply.like})")
         
         
         try:
@@ -209,8 +216,10 @@ class BiliCommentsFetcher:
             if not bv_param:
                 print("输入格式不正确，请重新输入")
                 continue
+            self._reload_cookies_if_changed()
                 
-            aid, title = self._get_video_aid(bv_param)
+            with self.profiler.stage("metadata"):
+                aid, title = self._get_video_aid(bv_param)
             if not aid:
                 print("获取视频AID失败，请检查输入是否正确")
                 continue
@@ -227,7 +236,8 @@ class BiliCommentsFetcher:
             os.makedirs(comment_dir, exist_ok=True)
             
             page_size = 20
-            first_page = self._get_comments(oid=aid, page=1, page_size=page_size, sort=1)
+            with self.profiler.stage("transfer"):
+                first_page = self._get_comments(oid=aid, page=1, page_size=page_size, sort=1)
             if not first_page or first_page.get("code") != 0:
                 print("获取评论失败，请检查输入是否正确")
                 continue
@@ -249,11 +259,13 @@ class BiliCommentsFetcher:
             print(f"准备下载第 {', '.join(map(str, pages_to_download))} 页评论...")
             txt_filename = os.path.join(comment_dir, f"{safe_title}.txt")
             open(txt_filename, 'w', encoding='utf-8').close()
+            columns_builder = CommentColumnsBuilder()
             for page_num in tqdm(pages_to_download, desc="下载评论页"):
                 if page_num == 1:
                     comments = first_page  
                 else:
-                    comments = self._get_comments(oid=aid, page=page_num, page_size=page_size, sort=1)
+                    with self.profiler.stage("transfer"):
+                        comments = self._get_comments(oid=aid, page=page_num, page_size=page_size, sort=1)
                 
                 if not comments or comments.get("code") != 0:
                     print(f"获取第 {page_num} 页评论失败，跳过")
@@ -261,9 +273,18 @@ class BiliCommentsFetcher:
                     
                 json_filename = os.path.join(comment_dir, f"{safe_title}_page{page_num}.json")
                 
-                self.save_comments_to_json(comments, json_filename)
-                self.save_comments_to_txt(comments, txt_filename)
+                with self.profiler.stage("persist"):
+                    self.save_comments_to_json(comments, json_filename)
+                with self.profiler.stage("parse"):
+                    page = parse_comment_page(comments)
+                with self.profiler.stage("persist"):
+                    self.save_comments_to_txt(page, txt_filename)
+                    columns_builder.add_page(page)
             
+            with self.profiler.stage("persist"):
+                columns = columns_builder.save(os.path.join(comment_dir, f"{safe_title}_columns"))
+            if columns is not None:
+                columns.print_summary()
             print(f"所有选择的评论页已保存到目录: {comment_dir}")
 
             
@@ -5,14 +5,18 @@ import os
 import time
 import re
 from urllib.parse import unquote
-from typing import Optional
+from typing import Callable, Optional
 import json
+from wbi import wbi_signer
 
 # COOKIE_FILE = "bilibili_cookies.txt"
 
 COOKIES_DIR = "cookies"
 COOKIE_FILE = os.path.join(COOKIES_DIR, "bilibili_cookies.txt")
 JSON_COOKIE_FILE = os.path.join(COOKIES_DIR, "bilibili_cookies.json")
+# refresh_token不能用.txt结尾, 否则会被账号池当作另一个账号的Cookie文件
+REFRESH_TOKEN_EXT = ".refresh_token"
+LEGACY_REFRESH_TOKEN_SUFFIX = "_refresh_token.txt"
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
@@ -21,25 +25,35 @@ HEADERS = {
 }
 
 class BilibiliQRLogin:
-    def __init__(self):
+    def __init__(self, cookie_file: str = COOKIE_FILE, log: Optional[Callable] = None):
+        self.log = log or print  # 账号池和库调用时可传入日志函数或静默
         self.session = requests.Session()
-        self.cookie_jar = LWPCookieJar(COOKIE_FILE)
+        self.cookie_file = cookie_file
+        self.json_cookie_file = os.path.splitext(cookie_file)[0] + ".json"
+        self.refresh_token_file = os.path.splitext(cookie_file)[0] + REFRESH_TOKEN_EXT
+        self.cookie_jar = LWPCookieJar(cookie_file)
         self.bili_jct: Optional[str] = None
+        self.nav_data: dict = {}
+        self._cookie_mtime = 0.0
         
         self.session.cookies = self.cookie_jar
         
-        os.makedirs(COOKIES_DIR, exist_ok=True)
+        os.makedirs(os.path.dirname(cookie_file) or ".", exist_ok=True)
+        legacy_token_file = os.path.splitext(cookie_file)[0] + LEGACY_REFRESH_TOKEN_SUFFIX
+        if os.path.exists(legacy_token_file) and not os.path.exists(self.refresh_token_file):
+            os.replace(legacy_token_file, self.refresh_token_file)
         # 如果cookie文件存在则尝试加载
-        if os.path.exists(COOKIE_FILE):
+        if os.path.exists(cookie_file):
             try:
+                self._cookie_mtime = os.path.getmtime(cookie_file)
                 self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
-                print("检测到已保存的Cookie文件，尝试恢复登录状态...")
+                self.log("检测到已保存的Cookie文件，尝试恢复登录状态...")
                 
                 # 将cookie加载到session
                 for cookie in self.cookie_jar:
                     self.session.cookies.set_cookie(cookie)
             except Exception as e:
-                print(f"加载Cookie文件出错: {e}")
+                self.log(f"加载Cookie文件出错: {e}")
     
     def is_logged_in(self) -> bool:
         """检查登录状态"""
@@ -50,15 +64,52 @@ class BilibiliQRLogin:
                 timeout=10
             )
             data = response.json()
+            wbi_signer.update_from_nav(data, self.log)
+            self.nav_data = data.get("data") or {}
             if data.get("code") == 0 and data.get("data", {}).get("isLogin"):
-                print(f"登录状态有效! 用户名: {data['data']['uname']}")
+                self.log(f"登录状态有效! 用户名: {data['data']['uname']}")
                 return True
-            print("登录状态无效，需要重新登录")
+            self.log("登录状态无效，需要重新登录")
             return False
         except Exception as e:
-            print(f"检查登录状态失败: {e}")
+            self.log(f"检查登录状态失败: {e}")
             return False
     
+    def save_cookies(self) -> None:
+        """先写临时文件再替换, 其他进程读取时不会读到写了一半的文件"""
+        tmp_file = f"{self.cookie_file}.tmp"
+        self.cookie_jar.save(filename=tmp_file, ignore_discard=True, ignore_expires=True)
+        os.replace(tmp_file, self.cookie_file)
+        self._cookie_mtime = os.path.getmtime(self.cookie_file)
+    
+    def reload_if_changed(self) -> None:
+        """Cookie文件被其他进程或后台线程刷新后重新加载到当前会话"""
+        try:
+            mtime = os.path.getmtime(self.cookie_file)
+        except OSError:
+            return
+        if mtime == self._cookie_mtime:
+            return
+        try:
+            self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
+            self._cookie_mtime = mtime
+        except Exception as e:
+            self.log(f"重新加载Cookie文件出错: {e}")
+    
+    def load_refresh_token(self) -> str:
+        if not os.path.exists(self.refresh_token_file):
+            return ""
+        with open(self.refresh_token_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    
+    def save_refresh_token(self, refresh_token: str) -> None:
+        if not refresh_token:
+            return
+        tmp_file = f"{self.refresh_token_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(refresh_token)
+        os.replace(tmp_file, self.refresh_token_file)
+    
     def generate_qr_code(self, url: str) -> None:
         """生成二维码并保存为文件"""
         try:
@@ -77,11 +128,11 @@ class BilibiliQRLogin:
             with open("bilibili_qrcode.png", "wb") as f:
                 img.save(f)
             
-            print("二维码已保存为: bilibili_qrcode.png")
-            print("请使用B站手机APP扫描二维码登录")
+            self.log("二维码已保存为: bilibili_qrcode.png")
+            self.log("请使用B站手机APP扫描二维码登录")
         except Exception as e:
-            print(f"生成二维码失败: {e}")
-            print(f"请手动访问以下链接登录: {url}")
+            self.log(f"生成二维码失败: {e}")
+            self.log(f"请手动访问以下链接登录: {url}")
     
     def qr_login(self) -> bool:
         """扫码登录主流程"""
@@ -90,7 +141,7 @@ class BilibiliQRLogin:
             self.convert_cookies_for_playwright()
             return True
             
-        print("需要登录，正在获取二维码...")
+        self.log("需要登录，正在获取二维码...")
         
         try:
             # 获取二维码信息
@@ -102,7 +153,7 @@ class BilibiliQRLogin:
             data = response.json()
             
             if data.get("code") != 0:
-                print(f"获取二维码失败: {data.get('message')}")
+                self.log(f"获取二维码失败: {data.get('message')}")
                 return False
                 
             qrcode_url = data["data"]["url"]
@@ -112,7 +163,7 @@ class BilibiliQRLogin:
             self.generate_qr_code(qrcode_url)
             
             # 轮询扫码状态
-            print("等待扫码... (按Ctrl+C取消)")
+            self.log("等待扫码... (按Ctrl+C取消)")
             start_time = time.time()
             timeout = 180  # 3分钟超时
             
@@ -126,7 +177,7 @@ class BilibiliQRLogin:
                     data = response.json()
                     
                     if data["code"] != 0:
-                        print(f"状态检查失败: {data.get('message')}")
+                        self.log(f"状态检查失败: {data.get('message')}")
                         time.sleep(2)
                         continue
                     
@@ -138,18 +189,19 @@ class BilibiliQRLogin:
                         confirm_url = data["data"]["url"]
                         self.session.get(confirm_url, headers=HEADERS, timeout=10)
                         
-                        # 保存cookie到文件
-                        self.cookie_jar.save(filename=COOKIE_FILE, ignore_discard=True, ignore_expires=True)
-                        print("登录成功! Cookie已保存")
+                        # 保存cookie和refresh_token到文件
+                        self.save_cookies()
+                        self.save_refresh_token(data["data"].get("refresh_token", ""))
+                        self.log("登录成功! Cookie已保存")
                         
                         # 提取bili_jct
-                        with open(COOKIE_FILE, "r", encoding="utf-8") as f:
+                        with open(self.cookie_file, "r", encoding="utf-8") as f:
                             cookies = f.read()
                         match = re.search(r"bili_jct=([^;]+)", cookies)
                         if match:
                             self.bili_jct = match.group(1)
                         else:
-                            print("警告: 未在Cookie中找到bili_jct")
+                            self.log("警告: 未在Cookie中找到bili_jct")
                         
                         # 显示用户信息
                         self.is_logged_in()
@@ -160,30 +212,30 @@ class BilibiliQRLogin:
                         return True
                     
                     elif status == 86101:  # 未扫码
-                        print(f"状态: {message}")
+                        self.log(f"状态: {message}")
                     elif status == 86090:  # 已扫码未确认
-                        print(f"状态: {message} - 请在手机APP上确认登录")
+                        self.log(f"状态: {message} - 请在手机APP上确认登录")
                     elif status == 86038:  # 二维码过期
-                        print(f"状态: {message}")
+                        self.log(f"状态: {message}")
                         return False
                     else:
-                        print(f"未知状态: {message}")
+                        self.log(f"未知状态: {message}")
                     
                     time.sleep(2)
                 except Exception as e:
-                    print(f"状态检查出错: {e}")
+                    self.log(f"状态检查出错: {e}")
                     time.sleep(2)
             
-            print("登录超时，请重试")
+            self.log("登录超时，请重试")
             return False
         except Exception as e:
-            print(f"登录过程中出错: {e}")
+            self.log(f"登录过程中出错: {e}")
             return False
     
     def convert_cookies_for_playwright(self) -> None:
         """将LWPCookieJar格式转换为Playwright可用的JSON格式"""
         if not hasattr(self, 'cookie_jar') or not self.cookie_jar:
-            print("未找到CookieJar对象，无法转换")
+            self.log("未找到CookieJar对象，无法转换")
             return
         
         playwright_cookies = []
@@ -209,39 +261,39 @@ class BilibiliQRLogin:
             playwright_cookies.append(playwright_cookie)
         
         # 保存为JSON文件
-        with open(JSON_COOKIE_FILE, "w", encoding="utf-8") as f:
+        with open(self.json_cookie_file, "w", encoding="utf-8") as f:
             json.dump(playwright_cookies, f, indent=2, ensure_ascii=False)
         
-        print(f"Cookie已转换为Playwright兼容格式并保存到 {JSON_COOKIE_FILE}")
-        print(f"转换了 {len(playwright_cookies)} 个Cookie")
+        self.log(f"Cookie已转换为Playwright兼容格式并保存到 {self.json_cookie_file}")
+        self.log(f"转换了 {len(playwright_cookies)} 个Cookie")
     
     def show_cookies(self) -> None:
         """显示已保存的Cookie"""
-        if not os.path.exists(COOKIE_FILE):
-            print("未找到Cookie文件")
+        if not os.path.exists(self.cookie_file):
+            self.log("未找到Cookie文件")
             return
             
-        print("\n保存的Cookie内容:")
-        with open(COOKIE_FILE, "r", encoding="utf-8") as f:
+        self.log("\n保存的Cookie内容:")
+        with open(self.cookie_file, "r", encoding="utf-8") as f:
             for line in f:
                 # 解码URL编码的特殊字符
                 decoded_line = unquote(line.strip())
-                print(decoded_line)
+                self.log(decoded_line)
     
     def logout(self) -> bool:
         """注销登录"""
         # 尝试获取bili_jct
         if not self.bili_jct:
             # 尝试从cookie文件读取bili_jct
-            if os.path.exists(COOKIE_FILE):
-                with open(COOKIE_FILE, "r", encoding="utf-8") as f:
+            if os.path.exists(self.cookie_file):
+                with open(self.cookie_file, "r", encoding="utf-8") as f:
                     cookies = f.read()
                 match = re.search(r"bili_jct=([^;]+)", cookies)
                 if match:
                     self.bili_jct = match.group(1)
         
         if not self.bili_jct:
-            print("未找到bili_jct，无法注销")
+            self.log("未找到bili_jct，无法注销")
             return False
         
         try:
@@ -254,21 +306,23 @@ class BilibiliQRLogin:
             data = response.json()
             
             if data.get("code") == 0:
-                print("注销成功")
+                self.log("注销成功")
                 # 删除cookie文件
-                if os.path.exists(COOKIE_FILE):
-                    os.remove(COOKIE_FILE)
-                    print("Cookie文件已删除")
-                if os.path.exists(JSON_COOKIE_FILE):
-                    os.remove(JSON_COOKIE_FILE)
-                    print("JSON Cookie文件已删除")
+                if os.path.exists(self.cookie_file):
+                    os.remove(self.cookie_file)
+                    self.log("Cookie文件已删除")
+                if os.path.exists(self.json_cookie_file):
+                    os.remove(self.json_cookie_file)
+                    self.log("JSON Cookie文件已删除")
+                if os.path.exists(self.refresh_token_file):
+                    os.remove(self.refresh_token_file)
                 self.bili_jct = None
                 return True
             else:
-                print(f"注销失败: {data.get('message')}")
+                self.log(f"注销失败: {data.get('message')}")
                 return False
         except Exception as e:
-            print(f"注销过程中出错: {e}")
+            self.log(f"注销过程中出错: {e}")
             return False
 
 def main():
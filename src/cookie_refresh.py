@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import base64
+import hashlib
+import threading
+from typing import Optional
+from cookie import BilibiliQRLogin, HEADERS
+
+COOKIE_INFO_URL = "https://passport.bilibili.com/x/passport-login/web/cookie/info"
+CORRESPOND_URL = "https://www.bilibili.com/correspond/1/"
+COOKIE_REFRESH_URL = "https://passport.bilibili.com/x/passport-login/web/cookie/refresh"
+CONFIRM_REFRESH_URL = "https://passport.bilibili.com/x/passport-login/web/confirm/refresh"
+
+CHECK_INTERVAL = 6 * 3600
+
+# 生成correspondPath所用的B站RSA公钥
+BILIBILI_PUBLIC_KEY = """-----BEGIN PUBLIC KEY-----
+MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDLgd2OAkcGVtoE3ThUREbio0Eg
+Uc/prcajMKXvkCKFCWhJYJcLkcM2DKKcSeFpD/j6Boy538YXnR6VhcuUJOhH2x71
+nzPjfdTcqMz7djHum0qSZA0AyCBDABUqCrfNgCiJ00Ra7GmRj+YCK1NJEuewlb40
+JNrRuoEUXpabUzGB8QIDAQAB
+-----END PUBLIC KEY-----"""
+
+
+def _der_read(der: bytes, pos: int) -> tuple[int, bytes, int]:
+    """读取一个DER元素, 返回 (tag, 内容, 下一个元素的位置)"""
+    tag = der[pos]
+    length = der[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(der[pos:pos + size], "big")
+        pos += size
+    return tag, der[pos:pos + length], pos + length
+
+
+def load_rsa_public_key(pem: str) -> tuple[int, int]:
+    """解析SubjectPublicKeyInfo格式的PEM公钥, 返回 (n, e)"""
+    body = "".join(line for line in pem.strip().splitlines() if not line.startswith("-----"))
+    der = base64.b64decode(body)
+    _, spki, _ = _der_read(der, 0)
+    _, _, pos = _der_read(spki, 0)  # AlgorithmIdentifier
+    _, bit_string, _ = _der_read(spki, pos)
+    _, rsa_key, _ = _der_read(bit_string[1:], 0)  # 跳过BIT STRING的未用位数字节
+    _, n, pos = _der_read(rsa_key, 0)
+    _, e, _ = _der_read(rsa_key, pos)
+    return int.from_bytes(n, "big"), int.from_bytes(e, "big")
+
+
+def _mgf1(seed: bytes, length: int) -> bytes:
+    output = b""
+    counter = 0
+    while len(output) < length:
+        output += hashlib.sha256(seed + counter.to_bytes(4, "big")).digest()
+        counter += 1
+    return output[:length]
+
+
+def rsa_oaep_encrypt(message: bytes, public_key: tuple[int, int]) -> bytes:
+    """RSA-OAEP(SHA-256) 加密, 只用到公钥运算, 无需额外依赖"""
+    n, e = public_key
+    k = (n.bit_length() + 7) // 8
+    h_len = hashlib.sha256().digest_size
+    if len(message) > k - 2 * h_len - 2:
+        raise ValueError("待加密内容过长")
+    l_hash = hashlib.sha256(b"").digest()
+    db = l_hash + b"\x00" * (k - len(message) - 2 * h_len - 2) + b"\x01" + message
+    seed = os.urandom(h_len)
+    masked_db = bytes(a ^ b for a, b in zip(db, _mgf1(seed, k - h_len - 1)))
+    masked_seed = bytes(a ^ b for a, b in zip(seed, _mgf1(masked_db, h_len)))
+    em = b"\x00" + masked_seed + masked_db
+    return pow(int.from_bytes(em, "big"), e, n).to_bytes(k, "big")
+
+
+def get_correspond_path(timestamp: int) -> str:
+    return rsa_oaep_encrypt(f"refresh_{timestamp}".encode(), load_rsa_public_key(BILIBILI_PUBLIC_KEY)).hex()
+
+
+class CookieRefresher:
+    """定期检查Cookie是否需要刷新, 需要时走refresh_token流程并原子地写回Cookie文件"""
+
+    def __init__(self, login: Optional[BilibiliQRLogin] = None, interval: int = CHECK_INTERVAL):
+        self.login = login or BilibiliQRLogin()
+        self.session = self.login.session
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _cookie_value(self, name: str) -> str:
+        for cookie in self.login.cookie_jar:
+            if cookie.name == name:
+                return cookie.value
+        return ""
+
+    def check(self) -> Optional[dict]:
+        """返回cookie/info的data部分, 未登录或请求失败时返回None"""
+        try:
+            response = self.session.get(
+                COOKIE_INFO_URL,
+                params={"csrf": self._cookie_value("bili_jct")},
+                headers=HEADERS,
+                timeout=10
+            )
+            data = response.json()
+            if data.get("code") != 0:
+                print(f"检查Cookie状态失败: {data.get('message')}")
+                return None
+            return data.get("data") or {}
+        except Exception as e:
+            print(f"检查Cookie状态失败: {e}")
+            return None
+
+    def _get_refresh_csrf(self, timestamp: int) -> str:
+        response = self.session.get(
+            CORRESPOND_URL + get_correspond_path(timestamp),
+            headers=HEADERS,
+            timeout=10
+        )
+        response.raise_for_status()
+        match = re.search(r'<div id="1-name">(.+?)</div>', response.text)
+        return match.group(1) if match else ""
+
+    def refresh(self, timestamp: Optional[int] = None) -> bool:
+        """执行一次完整的Cookie刷新流程"""
+        old_refresh_token = self.login.load_refresh_token()
+        if not old_refresh_token:
+            print("未找到refresh_token，无法自动刷新Cookie，请重新扫码登录")
+            return False
+        try:
+            refresh_csrf = self._get_refresh_csrf(timestamp or int(time.time() * 1000))
+            if not refresh_csrf:
+                print("获取refresh_csrf失败")
+                return False
+
+            response = self.session.post(
+                COOKIE_REFRESH_URL,
+                headers=HEADERS,
+                data={
+                    "csrf": self._cookie_value("bili_jct"),
+                    "refresh_csrf": refresh_csrf,
+                    "source": "main_web",
+                    "refresh_token": old_refresh_token,
+                },
+                timeout=10
+            )
+            data = response.json()
+            if data.get("code") != 0:
+                print(f"刷新Cookie失败: {data.get('message')}")
+                return False
+
+            # 先落盘新Cookie和refresh_token, 再让旧的refresh_token失效
+            self.login.save_cookies()
+            self.login.save_refresh_token(data["data"]["refresh_token"])
+            self.login.bili_jct = self._cookie_value("bili_jct")
+
+            response = self.session.post(
+                CONFIRM_REFRESH_URL,
+                headers=HEADERS,
+                data={"csrf": self.login.bili_jct, "refresh_token": old_refresh_token},
+                timeout=10
+            )
+            confirm = response.json()
+            if confirm.get("code") != 0:
+                print(f"确认刷新失败: {confirm.get('message')}")
+            print("Cookie刷新成功")
+            return True
+        except Exception as e:
+            print(f"刷新Cookie出错: {e}")
+            return False
+
+    def check_and_refresh(self) -> bool:
+        info = self.check()
+        if info is None:
+            return False
+        if not info.get("refresh"):
+            return True
+        print("Cookie即将过期，正在刷新...")
+        return self.refresh(info.get("timestamp"))
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.check_and_refresh()
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        """在后台线程中定期检查"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="cookie-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+def main():
+    CookieRefresher().check_and_refresh()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import secrets
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8700
+TOKEN_ENV = "BILI_COORDINATOR_TOKEN"
+TOKEN_HEADER = "X-Coordinator-Token"
+RANGE_SIZE = 16 * 1024 * 1024
+MIN_STEAL_BYTES = 4 * 1024 * 1024
+LEASE_TTL = 30
+
+
+def check_relative_path(path: str) -> str:
+    """任务中的输出路径只能是输出目录下的相对路径"""
+    if not isinstance(path, str) or not path or "\x00" in path:
+        raise ValueError(f"无效的输出路径: {path!r}")
+    normalized = path.replace("\\", "/")
+    if os.path.isabs(path) or normalized.startswith("/") or ":" in normalized.split("/")[0]:
+        raise ValueError(f"输出路径不能是绝对路径: {path}")
+    if any(part == ".." for part in normalized.split("/")):
+        raise ValueError(f"输出路径不能包含..: {path}")
+    return path
+
+
+def request_token(token: str = "") -> str:
+    return token or os.environ.get(TOKEN_ENV, "")
+
+
+class Coordinator:
+    """分发下载任务租约的协调器
+
+    任务分两种: resolve(由worker获取视频信息和下载地址) 和 range(下载文件的一段字节)。
+    租约需要定期心跳, 过期后未完成的部分重新排队; 没有待分配任务时, 从剩余最多的
+    range租约中切走后一半分给空闲的worker
+    """
+
+    def __init__(self, range_size: int = RANGE_SIZE, lease_ttl: int = LEASE_TTL):
+        self.range_size = range_size
+        self.lease_ttl = lease_ttl
+        self.jobs: dict[str, dict] = {}
+        self.files: dict[str, dict] = {}
+        self.tasks: dict[str, dict] = {}
+        self.leases: dict[str, dict] = {}
+        self.pending: deque = deque()
+        self.expired = 0
+        self.stolen = 0
+        self._lock = threading.Lock()
+
+    def _new_task(self, kind: str, queued: bool = True, **fields) -> dict:
+        task = dict(fields, id=uuid.uuid4().hex[:12], kind=kind, state="pending")
+        self.tasks[task["id"]] = task
+        if queued:
+            self.pending.append(task["id"])
+        return task
+
+    def submit(self, job: dict) -> str:
+        """job: {"bvid", "qn", "pages"} 由worker解析; 或 {"url", "size", "path", "headers"} 直接下载"""
+        direct = self.validate(job)
+        with self._lock:
+            job_id = uuid.uuid4().hex[:12]
+            self.jobs[job_id] = dict(job, id=job_id, state="pending")
+            if direct:
+                self._add_file(job_id, job)
+            else:
+                self._new_task("resolve", job_id=job_id, bvid=job["bvid"], qn=job.get("qn"), pages=job.get("pages"))
+            return job_id
+
+    @staticmethod
+    def validate(job: dict) -> bool:
+        """检查任务格式, 返回是否为直接下载的任务"""
+        if job.get("url") and job.get("size"):
+            check_relative_path(job.get("path"))
+            return True
+        if not job.get("bvid"):
+            raise ValueError("任务需要bvid, 或url、size和path")
+        return False
+
+    def _add_file(self, job_id: str, entry: dict) -> None:
+        file_id = uuid.uuid4().hex[:12]
+        check_relative_path(entry["path"])
+        size = int(entry["size"])
+        self.files[file_id] = {
+            "id": file_id,
+            "job_id": job_id,
+            "path": entry["path"],
+            "url": entry["url"],
+            "size": size,
+            "headers": entry.get("headers") or {},
+            "bvid": entry.get("bvid"),
+            "cid": entry.get("cid"),
+            "qn": entry.get("qn"),
+            "open_ranges": 0,
+            "completed_bytes": 0,
+            "state": "downloading",
+        }
+        for start in range(0, size, self.range_size):
+            self._new_task("range", file_id=file_id, start=start, end=min(size, start + self.range_size) - 1)
+            self.files[file_id]["open_ranges"] += 1
+
+    def _confirm_progress(self, task: dict, progress: int) -> None:
+        """把租约已确认写入的字节计入文件完成量, 剩余部分从新的start开始"""
+        confirmed = max(0, min(progress, task["end"] - task["start"] + 1))
+        task["start"] += confirmed
+        self.files[task["file_id"]]["completed_bytes"] += confirmed
+
+    def _expire_leases(self, now: float) -> None:
+        for lease_id, lease in list(self.leases.items()):
+            if lease["expires"] >= now:
+                continue
+            del self.leases[lease_id]
+            task = self.tasks[lease["task_id"]]
+            if task["kind"] == "range":
+                self._confirm_progress(task, lease["progress"])  # 已确认写入的部分不需要重新下载
+            task["state"] = "pending"
+            self.pending.appendleft(task["id"])
+            self.expired += 1
+            print(f"租约过期: {lease['worker']} {task['kind']} {task['id']}")
+
+    def _steal(self, now: float):
+        """从剩余字节最多的range租约中切出后一半"""
+        best, best_remaining = None, MIN_STEAL_BYTES * 2
+        for lease in self.leases.values():
+            task = self.tasks[lease["task_id"]]
+            if task["kind"] != "range":
+                continue
+            remaining = task["end"] - (task["start"] + lease["progress"]) + 1
+            if remaining > best_remaining:
+                best, best_remaining = lease, remaining
+        if best is None:
+            return None
+        task = self.tasks[best["task_id"]]
+        split = task["end"] - best_remaining // 2 + 1
+        stolen = self._new_task("range", queued=False, file_id=task["file_id"], start=split, end=task["end"])
+        task["end"] = split - 1
+        self.files[task["file_id"]]["open_ranges"] += 1
+        self.stolen += 1
+        return stolen
+
+    def lease(self, worker: str) -> dict:
+        now = time.time()
+        with self._lock:
+            self._expire_leases(now)
+            task = None
+            while self.pending:
+                candidate = self.tasks[self.pending.popleft()]
+                if candidate["state"] == "pending":
+                    task = candidate
+                    break
+            if task is None:
+                task = self._steal(now)
+            if task is None:
+                return {"task": None, "finished": self._finished()}
+
+            task["state"] = "leased"
+            lease = {"id": uuid.uuid4().hex[:12], "task_id": task["id"], "worker": worker,
+                     "expires": now + self.lease_ttl, "progress": 0}
+            self.leases[lease["id"]] = lease
+            payload = dict(task)
+            if task["kind"] == "range":
+                file = self.files[task["file_id"]]
+                payload.update({k: file[k] for k in ("path", "url", "size", "headers", "bvid", "cid", "qn")})
+            return {"task": payload, "lease_id": lease["id"], "ttl": self.lease_ttl}
+
+    def heartbeat(self, lease_id: str, progress: int = 0) -> dict:
+        """progress为range任务从start开始已写入的字节数; 返回当前的end, 被切分后会变小"""
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return {"ok": False}
+            lease["progress"] = max(lease["progress"], progress)
+            lease["expires"] = time.time() + self.lease_ttl
+            task = self.tasks[lease["task_id"]]
+            return {"ok": True, "end": task.get("end"), "ttl": self.lease_ttl}
+
+    def complete(self, lease_id: str, result: dict) -> dict:
+        with self._lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return {"ok": False}
+            task = self.tasks[lease["task_id"]]
+            task["state"] = "done"
+            if task["kind"] == "resolve":
+                job = self.jobs[task["job_id"]]
+                added = 0
+                for entry in result.get("files", []):
+                    try:
+                        self._add_file(job["id"], entry)
+                        added += 1
+                    except (KeyError, ValueError) as e:
+                        print(f"忽略无效的文件: {e}")
+                job["state"] = "downloading" if added else "failed"
+                return {"ok": True}
+
+            file = self.files[task["file_id"]]
+            file["completed_bytes"] += max(0, task["end"] - task["start"] + 1)
+            file["open_ranges"] -= 1
+            if file["open_ranges"] > 0:
+                return {"ok": True, "finalize": False}
+            file["state"] = "done"
+            job = self.jobs[file["job_id"]]
+            if all(f["state"] == "done" for f in self.files.values() if f["job_id"] == job["id"]):
+                job["state"] = "done"
+            # 最后完成的worker负责把.part文件改为正式文件名
+            return {"ok": True, "finalize": True, "path": file["path"], "size": file["size"],
+                    "completed_bytes": file["completed_bytes"]}
+
+    def fail(self, lease_id: str, error: str) -> dict:
+        with self._lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return {"ok": False}
+            task = self.tasks[lease["task_id"]]
+            task["failures"] = task.get("failures", 0) + 1
+            print(f"任务失败: {lease['worker']} {task['kind']} {task['id']}: {error}")
+            if task["kind"] == "range":
+                self._confirm_progress(task, lease["progress"])
+            if task["failures"] >= 3:
+                task["state"] = "failed"
+                if task["kind"] == "resolve":
+                    self.jobs[task["job_id"]]["state"] = "failed"
+                else:
+                    self.files[task["file_id"]]["state"] = "failed"
+            else:
+                task["state"] = "pending"
+                self.pending.append(task["id"])
+            return {"ok": True}
+
+    def _finished(self) -> bool:
+        return bool(self.jobs) and not self.leases and all(t["state"] in ("done", "failed") for t in self.tasks.values())
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "jobs": {state: sum(j["state"] == state for j in self.jobs.values()) for state in ("pending", "downloading", "done", "failed")},
+                "files": [{"path": f["path"], "size": f["size"], "state": f["state"], "open_ranges": f["open_ranges"],
+                           "completed_bytes": f["completed_bytes"]} for f in self.files.values()],
+                "pending_tasks": len(self.pending),
+                "expired_leases": self.expired,
+                "stolen_ranges": self.stolen,
+                "leases": [{"worker": l["worker"], "task": l["task_id"], "progress": l["progress"]} for l in self.leases.values()],
+                "finished": self._finished(),
+            }
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    coordinator: Coordinator = None
+    token: str = ""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload: dict, code: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode(), self.token.encode()):
+            return True
+        self._reply({"error": "unauthorized"}, 401)
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._reply(self.coordinator.status())
+        else:
+            self._reply({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            c = self.coordinator
+            if self.path == "/jobs":
+                jobs = body.get("jobs", [])
+                for job in jobs:
+                    c.validate(job)  # 有一个无效就整批拒绝
+                self._reply({"job_ids": [c.submit(job) for job in jobs]})
+            elif self.path == "/lease":
+                self._reply(c.lease(body.get("worker", self.client_address[0])))
+            elif self.path == "/heartbeat":
+                self._reply(c.heartbeat(body["lease_id"], body.get("progress", 0)))
+            elif self.path == "/complete":
+                self._reply(c.complete(body["lease_id"], body.get("result", {})))
+            elif self.path == "/fail":
+                self._reply(c.fail(body["lease_id"], body.get("error", "")))
+            else:
+                self._reply({"error": "not found"}, 404)
+        except Exception as e:
+            self._reply({"error": str(e)}, 400)
+
+
+def serve(token: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          coordinator: Coordinator = None) -> ThreadingHTTPServer:
+    """所有请求都需要在请求头中带上相同的token"""
+    if not token:
+        raise ValueError("协调器需要设置token")
+    handler = type("Handler", (CoordinatorHandler,), {"coordinator": coordinator or Coordinator(), "token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式下载协调器")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="启动协调器")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST, help="其他机器的worker需要连接时改为0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--range-size", type=int, default=RANGE_SIZE)
+    serve_parser.add_argument("--token", default="", help=f"共享token, 也可以通过环境变量{TOKEN_ENV}设置")
+    submit_parser = sub.add_parser("submit", help="提交下载任务")
+    submit_parser.add_argument("bvids", nargs="+")
+    submit_parser.add_argument("--coordinator", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    submit_parser.add_argument("--qn", type=int, default=None)
+    submit_parser.add_argument("--token", default="")
+    status_parser = sub.add_parser("status", help="查看进度")
+    status_parser.add_argument("--coordinator", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    status_parser.add_argument("--token", default="")
+    args = parser.parse_args()
+    token = request_token(args.token)
+    headers = {TOKEN_HEADER: token}
+
+    if args.command == "serve":
+        if not token:
+            token = secrets.token_urlsafe(24)
+            print(f"未设置token, 已随机生成: {token}")
+        server = serve(token, args.host, args.port, Coordinator(range_size=args.range_size))
+        print(f"协调器已启动: http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == "submit":
+        jobs = [{"bvid": bvid, "qn": args.qn} for bvid in args.bvids]
+        response = requests.post(f"{args.coordinator}/jobs", json={"jobs": jobs}, headers=headers, timeout=10)
+        print(response.json())
+    elif args.command == "status":
+        print(json.dumps(requests.get(f"{args.coordinator}/status", headers=headers, timeout=10).json(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
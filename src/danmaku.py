@@ -0,0 +1,304 @@
+import os
+import re
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+from tqdm import tqdm
+from video_download import BiliVideoDownloader, HEADERS
+
+DANMAKU_SEG_URL = "https://api.bilibili.com/x/v2/dm/web/seg.so"
+SEGMENT_SECONDS = 360  # 每个分段6分钟
+MAX_WORKERS = 8
+DOWNLOADS_DIR = "bilibili_downloads"
+
+# DanmakuElem 字段号 -> (字段名, 是否为字符串)
+DANMAKU_FIELDS = {
+    1: ("id", False),
+    2: ("progress", False),
+    3: ("mode", False),
+    4: ("fontsize", False),
+    5: ("color", False),
+    6: ("midHash", True),
+    7: ("content", True),
+    8: ("ctime", False),
+    9: ("weight", False),
+    10: ("action", True),
+    11: ("pool", False),
+    12: ("idStr", True),
+    13: ("attr", False),
+}
+
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class IncompleteMessage(Exception):
+    pass
+
+
+def _read_varint(buf, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise IncompleteMessage()
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip_field(buf, pos: int, wire_type: int) -> int:
+    if wire_type == 0:
+        return _read_varint(buf, pos)[1]
+    if wire_type == 1:
+        pos += 8
+    elif wire_type == 2:
+        length, pos = _read_varint(buf, pos)
+        pos += length
+    elif wire_type == 5:
+        pos += 4
+    else:
+        raise ValueError(f"不支持的protobuf wire type: {wire_type}")
+    if pos > len(buf):
+        raise IncompleteMessage()
+    return pos
+
+
+def decode_danmaku_elem(buf) -> dict:
+    elem: dict = {"id": 0, "progress": 0, "mode": 1, "fontsize": 25, "color": 16777215, "midHash": "",
+                  "content": "", "ctime": 0, "weight": 0, "action": "", "pool": 0, "idStr": "", "attr": 0}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag, pos = _read_varint(buf, pos)
+        field, wire_type = tag >> 3, tag & 0x07
+        spec = DANMAKU_FIELDS.get(field)
+        if spec is None:
+            pos = _skip_field(buf, pos, wire_type)
+            continue
+        name, is_string = spec
+        if is_string:
+            length, pos = _read_varint(buf, pos)
+            elem[name] = bytes(buf[pos:pos + length]).decode("utf-8", errors="replace")
+            pos += length
+        else:
+            elem[name], pos = _read_varint(buf, pos)
+    return elem
+
+
+class DanmakuSegmentDecoder:
+    """DmSegMobileReply 的增量解码器, 每收到一块数据就解出其中完整的弹幕"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        self.buffer += chunk
+        elems: list[dict] = []
+        pos = 0
+        while pos < len(self.buffer):
+            try:
+                tag, body = _read_varint(self.buffer, pos)
+                field, wire_type = tag >> 3, tag & 0x07
+                if field == 1 and wire_type == 2:
+                    length, body = _read_varint(self.buffer, body)
+                    if body + length > len(self.buffer):
+                        break
+                    elems.append(decode_danmaku_elem(memoryview(self.buffer)[body:body + length]))
+                    pos = body + length
+                else:
+                    pos = _skip_field(self.buffer, body, wire_type)
+            except IncompleteMessage:
+                break
+        del self.buffer[:pos]
+        return elems
+
+    def close(self) -> None:
+        if self.buffer:
+            print(f"弹幕分段数据不完整, 丢弃末尾 {len(self.buffer)} 字节")
+            self.buffer.clear()
+
+
+def segment_count(duration: int) -> int:
+    return max(1, math.ceil(duration / SEGMENT_SECONDS))
+
+
+class BiliDanmakuDownloader:
+    def __init__(self, downloader: BiliVideoDownloader = None):
+        self.downloader = downloader or BiliVideoDownloader()
+        self.session = self.downloader.session
+
+    def _fetch_segment(self, aid, cid, index: int, referer: str) -> list[dict]:
+        params = {"type": 1, "oid": cid, "pid": aid, "segment_index": index}
+        headers = dict(HEADERS, Referer=referer)
+        decoder = DanmakuSegmentDecoder()
+        elems: list[dict] = []
+        with self.session.get(DANMAKU_SEG_URL, params=params, headers=headers, stream=True, timeout=10) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=16384):
+                if chunk:
+                    elems.extend(decoder.feed(chunk))
+        decoder.close()
+        return elems
+
+    def fetch_danmaku(self, aid, cid, duration: int, referer: str = "https://www.bilibili.com/") -> list[dict]:
+        """并发获取一个cid的全部弹幕分段, 按出现时间排序"""
+        count = segment_count(duration)
+        elems: list[dict] = []
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, count)) as executor:
+            futures = {executor.submit(self._fetch_segment, aid, cid, i, referer): i for i in range(1, count + 1)}
+            for future in tqdm(futures, desc="下载弹幕分段", total=count):
+                try:
+                    elems.extend(future.result())
+                except Exception as e:
+                    print(f"获取第 {futures[future]} 段弹幕失败: {e}")
+        elems.sort(key=lambda e: (e["progress"], e["id"]))
+        return elems
+
+    def save_xml(self, elems: list[dict], cid, filepath: str) -> None:
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<i>\n')
+            f.write(f"  <chatserver>chat.bilibili.com</chatserver>\n  <chatid>{cid}</chatid>\n")
+            f.write(f"  <maxlimit>{len(elems)}</maxlimit>\n")
+            for e in elems:
+                p = f"{e['progress'] / 1000:.5f},{e['mode']},{e['fontsize']},{e['color']},{e['ctime']},{e['pool']},{e['midHash']},{e['idStr'] or e['id']},{e['weight']}"
+                content = escape(_INVALID_XML_CHARS.sub("", e["content"]))
+                f.write(f'  <d p="{p}">{content}</d>\n')
+            f.write("</i>\n")
+
+    def save_jsonl(self, elems: list[dict], filepath: str) -> None:
+        with open(filepath, "w", encoding="utf-8") as f:
+            for e in elems:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+    def save_ass(self, elems: list[dict], filepath: str, width: int = 1920, height: int = 1080,
+                 font_size: int = 50, scroll_seconds: float = 8.0, fixed_seconds: float = 4.0) -> None:
+        """生成ASS字幕: 滚动弹幕从右向左移动, 顶部/底部弹幕固定显示"""
+        rows = max(1, int(height * 0.8) // font_size)
+        scroll_free = [0.0] * rows  # 每行下一条滚动弹幕可以进入的时间
+        top_free = [0.0] * rows
+        bottom_free = [0.0] * rows
+
+        def ass_time(seconds: float) -> str:
+            cs = int(round(seconds * 100))
+            return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+        def pick_row(free: list[float], start: float) -> int:
+            for row, t in enumerate(free):
+                if t <= start:
+                    return row
+            return min(range(rows), key=free.__getitem__)
+
+        lines = []
+        for e in elems:
+            text = e["content"].replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", " ")
+            start = e["progress"] / 1000
+            size = max(1, round(font_size * e["fontsize"] / 25))
+            color = e["color"] & 0xFFFFFF
+            bgr = f"{color & 0xFF:02X}{(color >> 8) & 0xFF:02X}{color >> 16:02X}"
+            text_width = len(text) * size
+            if e["mode"] == 4:
+                row = pick_row(bottom_free, start)
+                bottom_free[row] = start + fixed_seconds
+                y = height - row * font_size
+                end = start + fixed_seconds
+                effect = f"\\an2\\pos({width // 2},{y})"
+            elif e["mode"] == 5:
+                row = pick_row(top_free, start)
+                top_free[row] = start + fixed_seconds
+                end = start + fixed_seconds
+                effect = f"\\an8\\pos({width // 2},{row * font_size})"
+            elif e["mode"] in (1, 2, 3):
+                row = pick_row(scroll_free, start)
+                # 弹幕尾部完全进入屏幕后, 同一行才能出现下一条
+                scroll_free[row] = start + scroll_seconds * text_width / (width + text_width)
+                y = (row + 1) * font_size
+                end = start + scroll_seconds
+                effect = f"\\move({width},{y},{-text_width},{y})"
+            else:  # 高级/代码弹幕无法转换
+                continue
+            lines.append(f"Dialogue: 0,{ass_time(start)},{ass_time(end)},Danmaku,,0,0,0,,{{{effect}\\fs{size}\\c&H{bgr}&}}{text}")
+
+        with open(filepath, "w", encoding="utf-8-sig") as f:
+            f.write("[Script Info]\nScriptType: v4.00+\n")
+            f.write(f"PlayResX: {width}\nPlayResY: {height}\nScaledBorderAndShadow: yes\n\n")
+            f.write("[V4+ Styles]\n")
+            f.write("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n")
+            f.write(f"Style: Danmaku,Microsoft YaHei,{font_size},&H33FFFFFF,&H33FFFFFF,&H33000000,&H33000000,0,0,0,0,100,100,0,0,1,1,0,7,0,0,0,1\n\n")
+            f.write("[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+            f.write("\n".join(lines))
+            f.write("\n")
+
+    def download_page(self, video_data: dict, page_index: int, bv: str, formats: tuple = ("xml", "ass", "jsonl")) -> None:
+        page = video_data["pages"][page_index]
+        safe_title = re.sub(r'[\\/:*?"<>|]', "", video_data["title"])
+        safe_page_title = re.sub(r'[\\/:*?"<>|]', "", page["page_title"])
+        danmaku_path = os.path.join(DOWNLOADS_DIR, safe_title, "danmaku")
+        os.makedirs(danmaku_path, exist_ok=True)
+        basename = f"{safe_title}_{safe_page_title}" if video_data["pages_number"] > 1 else safe_title
+
+        referer = f"https://www.bilibili.com/video/{bv.removeprefix('bvid=')}?p={page['page_number']}"
+        print(f"\n开始下载分P{page['page_number']}弹幕 ({segment_count(page['duration'])} 段)")
+        elems = self.fetch_danmaku(video_data["aid"], page["cid"], page["duration"], referer)
+
+        for fmt in formats:
+            filepath = os.path.join(danmaku_path, f"{basename}.{fmt}")
+            try:
+                if fmt == "xml":
+                    self.save_xml(elems, page["cid"], filepath)
+                elif fmt == "ass":
+                    self.save_ass(elems, filepath)
+                elif fmt == "jsonl":
+                    self.save_jsonl(elems, filepath)
+                else:
+                    print(f"不支持的弹幕格式: {fmt}")
+                    continue
+                print(f"弹幕已保存到: {filepath}")
+            except Exception as e:
+                print(f"保存弹幕失败: {e}")
+        print(f"分P{page['page_number']}共 {len(elems)} 条弹幕")
+
+    def run(self):
+        self.downloader.is_logged_in()
+        while True:
+            text: str = input("输入视频BV/URL(输入q退出):\n").strip()
+            if text.lower() == 'q':
+                return
+            bv: str = self.downloader._bv_parser(text)
+            if not bv:
+                print("输入错误，请重新输入")
+                continue
+            video_data: dict = self.downloader._video_data_get(bv)
+            if not video_data:
+                print("获取视频信息失败，请检查BV号是否正确")
+                continue
+            self.downloader.print_video_data(video_data)
+
+            print("请输入要下载弹幕的分P序号, 多个分P用空格分隔, 输入all下载全部")
+            page_input = input().strip()
+            if page_input.lower() == 'all':
+                page_indexes = list(range(len(video_data["pages"])))
+            else:
+                page_indexes = []
+                for page_number in page_input.split():
+                    if page_number.isdigit() and 1 <= int(page_number) <= len(video_data["pages"]):
+                        page_indexes.append(int(page_number) - 1)
+                    else:
+                        print(f"输入错误，分P序号{page_number}不存在")
+
+            for page_index in page_indexes:
+                try:
+                    self.download_page(video_data, page_index, bv)
+                except Exception as e:
+                    print(f"下载分P{page_index + 1}弹幕失败: {e}")
+
+
+def main():
+    BiliDanmakuDownloader().run()
+
+
+if __name__ == "__main__":
+    main()
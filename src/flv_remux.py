@@ -0,0 +1,489 @@
+import os
+import sys
+import struct
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Optional
+
+FLV_TAG_AUDIO = 8
+FLV_TAG_VIDEO = 9
+FLV_CODEC_AVC = 7
+FLV_SOUND_AAC = 10
+
+VIDEO_TRACK_ID = 1
+AUDIO_TRACK_ID = 2
+VIDEO_TIMESCALE = 1000  # FLV时间戳单位为毫秒
+AAC_FRAME_SAMPLES = 1024
+
+MAX_FRAGMENT_BYTES = 8 * 1024 * 1024
+MAX_AUDIO_ONLY_SAMPLES = 200
+MAX_PROBE_BYTES = 1024 * 1024
+
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+UNITY_MATRIX = struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+class UnsupportedFlvCodec(Exception):
+    pass
+
+
+def _box(kind: bytes, *payloads: bytes) -> bytes:
+    payload = b"".join(payloads)
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def _full_box(kind: bytes, version: int, flags: int, *payloads: bytes) -> bytes:
+    return _box(kind, struct.pack(">I", (version << 24) | flags), *payloads)
+
+
+class _BitReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def bit(self) -> int:
+        byte = self.data[self.pos >> 3]
+        value = (byte >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return value
+
+    def bits(self, n: int) -> int:
+        value = 0
+        for _ in range(n):
+            value = (value << 1) | self.bit()
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while self.bit() == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_sps_resolution(sps: bytes) -> tuple[int, int]:
+    """从H.264 SPS中解析视频宽高"""
+    rbsp = sps[1:].replace(b"\x00\x00\x03", b"\x00\x00")
+    r = _BitReader(rbsp)
+    profile_idc = r.bits(8)
+    r.bits(16)  # constraint flags + level_idc
+    r.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = r.ue()
+        if chroma_format_idc == 3:
+            r.bit()
+        r.ue()
+        r.ue()
+        r.bit()
+        if r.bit():  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if r.bit():
+                    last, next_scale = 8, 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale != 0:
+                            next_scale = (last + r.se() + 256) % 256
+                        last = next_scale or last
+    r.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = r.ue()
+    if pic_order_cnt_type == 0:
+        r.ue()
+    elif pic_order_cnt_type == 1:
+        r.bit()
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()  # max_num_ref_frames
+    r.bit()
+    width_mbs = r.ue() + 1
+    height_units = r.ue() + 1
+    frame_mbs_only = r.bit()
+    if not frame_mbs_only:
+        r.bit()
+    r.bit()
+    crop_left = crop_right = crop_top = crop_bottom = 0
+    if r.bit():
+        crop_left, crop_right, crop_top, crop_bottom = r.ue(), r.ue(), r.ue(), r.ue()
+
+    sub_width = 2 if chroma_format_idc in (1, 2) else 1
+    sub_height = 2 if chroma_format_idc == 1 else 1
+    crop_unit_x = sub_width if chroma_format_idc else 1
+    crop_unit_y = (sub_height if chroma_format_idc else 1) * (2 - frame_mbs_only)
+    width = width_mbs * 16 - (crop_left + crop_right) * crop_unit_x
+    height = (2 - frame_mbs_only) * height_units * 16 - (crop_top + crop_bottom) * crop_unit_y
+    return width, height
+
+
+class _Sample:
+    __slots__ = ("dts", "cts", "data", "keyframe", "duration")
+
+    def __init__(self, dts: int, cts: int, data: bytes, keyframe: bool):
+        self.dts = dts
+        self.cts = cts
+        self.data = data
+        self.keyframe = keyframe
+        self.duration = 0
+
+
+class FlvToMp4Remuxer:
+    """把FLV(AVC+AAC)流边接收边转封装为fragmented MP4
+
+    每个GOP输出一个moof+mdat分片, 内存占用只与单个GOP大小有关, 不需要对文件做第二次读写
+    """
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.buffer = bytearray()
+        self.header_parsed = False
+        self.has_video = False
+        self.has_audio = False
+        self.probing = True
+        self.raw_prefix = bytearray()  # 确认编码前收到的原始数据, 不支持时供调用方回退为直接保存flv
+
+        self.avc_config: Optional[bytes] = None
+        self.width = 0
+        self.height = 0
+        self.audio_config: Optional[bytes] = None
+        self.sample_rate = 44100
+        self.channels = 2
+
+        self.init_written = False
+        self.base_dts: Optional[int] = None
+        self.sequence = 0
+        self.video_samples: list[_Sample] = []
+        self.audio_samples: list[bytes] = []
+        self.pending_bytes = 0
+        self.audio_decode_time: Optional[int] = None
+        self.last_video_duration = 40
+        self.bytes_written = 0
+
+    def _write(self, data: bytes) -> None:
+        self.output.write(data)
+        self.bytes_written += len(data)
+
+    def feed(self, chunk: bytes) -> None:
+        if self.probing:
+            self.raw_prefix += chunk
+            if len(self.raw_prefix) > MAX_PROBE_BYTES:
+                self._end_probe()
+        self.buffer += chunk
+        pos = 0
+        if not self.header_parsed:
+            if len(self.buffer) < 13:
+                return
+            if self.buffer[:3] != b"FLV":
+                raise UnsupportedFlvCodec("不是FLV数据")
+            flags = self.buffer[4]
+            self.has_audio = bool(flags & 0x04)
+            self.has_video = bool(flags & 0x01)
+            pos = struct.unpack(">I", self.buffer[5:9])[0] + 4  # 跳过header和PreviousTagSize0
+            self.header_parsed = True
+
+        while len(self.buffer) - pos >= 11:
+            tag_type = self.buffer[pos] & 0x1F
+            data_size = int.from_bytes(self.buffer[pos + 1:pos + 4], "big")
+            end = pos + 11 + data_size + 4
+            if len(self.buffer) < end:
+                break
+            timestamp = int.from_bytes(self.buffer[pos + 4:pos + 7], "big") | (self.buffer[pos + 7] << 24)
+            data = bytes(self.buffer[pos + 11:pos + 11 + data_size])
+            if tag_type == FLV_TAG_VIDEO:
+                self._on_video(timestamp, data)
+            elif tag_type == FLV_TAG_AUDIO:
+                self._on_audio(timestamp, data)
+            pos = end
+        del self.buffer[:pos]
+
+    def _end_probe(self) -> None:
+        self.probing = False
+        self.raw_prefix = bytearray()
+
+    def _check_probe(self) -> None:
+        if self.probing and (self.avc_config or not self.has_video) and (self.audio_config or not self.has_audio):
+            self._end_probe()
+
+    def _on_video(self, timestamp: int, data: bytes) -> None:
+        if len(data) < 5:
+            return
+        codec_id = data[0] & 0x0F
+        if codec_id != FLV_CODEC_AVC:
+            raise UnsupportedFlvCodec(f"不支持的视频编码: {codec_id}")
+        keyframe = (data[0] >> 4) == 1
+        packet_type = data[1]
+        cts = int.from_bytes(data[2:5], "big", signed=True)
+        if packet_type == 0:
+            self.avc_config = data[5:]
+            sps_len = struct.unpack(">H", self.avc_config[6:8])[0]
+            self.width, self.height = parse_sps_resolution(self.avc_config[8:8 + sps_len])
+            self._check_probe()
+            return
+        if packet_type != 1:
+            return
+        if self.base_dts is None:
+            self.base_dts = timestamp
+        if self.video_samples and (keyframe or self.pending_bytes + len(data) > MAX_FRAGMENT_BYTES):
+            self._flush(timestamp)
+        self.video_samples.append(_Sample(timestamp, cts, data[5:], keyframe))
+        self.pending_bytes += len(data) - 5
+
+    def _on_audio(self, timestamp: int, data: bytes) -> None:
+        if len(data) < 2:
+            return
+        sound_format = data[0] >> 4
+        if sound_format != FLV_SOUND_AAC:
+            raise UnsupportedFlvCodec(f"不支持的音频编码: {sound_format}")
+        if data[1] == 0:
+            self.audio_config = data[2:]
+            object_type = self.audio_config[0] >> 3
+            freq_index = ((self.audio_config[0] & 0x07) << 1) | (self.audio_config[1] >> 7)
+            if freq_index < len(AAC_SAMPLE_RATES):
+                self.sample_rate = AAC_SAMPLE_RATES[freq_index]
+            self.channels = (self.audio_config[1] >> 3) & 0x0F or 2
+            if object_type == 5:  # HE-AAC 的实际输出采样率翻倍
+                self.sample_rate *= 2
+            self._check_probe()
+            return
+        if self.base_dts is None:
+            self.base_dts = timestamp
+        if self.audio_decode_time is None:
+            self.audio_decode_time = (timestamp - self.base_dts) * self.sample_rate // 1000
+        self.audio_samples.append(data[2:])
+        self.pending_bytes += len(data) - 2
+        if not self.has_video and len(self.audio_samples) >= MAX_AUDIO_ONLY_SAMPLES:
+            self._flush(None)
+
+    def _init_segment(self) -> bytes:
+        traks = []
+        trexs = []
+        if self.avc_config:
+            traks.append(self._video_trak())
+            trexs.append(_full_box(b"trex", 0, 0, struct.pack(">5I", VIDEO_TRACK_ID, 1, 0, 0, 0)))
+        if self.audio_config:
+            traks.append(self._audio_trak())
+            trexs.append(_full_box(b"trex", 0, 0, struct.pack(">5I", AUDIO_TRACK_ID, 1, 0, 0, 0)))
+        mvhd = _full_box(
+            b"mvhd", 0, 0,
+            struct.pack(">4I", 0, 0, VIDEO_TIMESCALE, 0), struct.pack(">IH", 0x00010000, 0x0100),
+            b"\x00" * 10, UNITY_MATRIX, b"\x00" * 24, struct.pack(">I", AUDIO_TRACK_ID + 1),
+        )
+        ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso6avc1mp41")
+        return ftyp + _box(b"moov", mvhd, *traks, _box(b"mvex", *trexs))
+
+    def _trak(self, track_id: int, timescale: int, handler: bytes, name: bytes, media_header: bytes,
+              sample_entry: bytes, volume: int, width: int, height: int) -> bytes:
+        tkhd = _full_box(
+            b"tkhd", 0, 3,
+            struct.pack(">5I", 0, 0, track_id, 0, 0), b"\x00" * 8, struct.pack(">HHHH", 0, 0, volume, 0),
+            UNITY_MATRIX, struct.pack(">II", width << 16, height << 16),
+        )
+        mdhd = _full_box(b"mdhd", 0, 0, struct.pack(">4I", 0, 0, timescale, 0), struct.pack(">HH", 0x55C4, 0))
+        hdlr = _full_box(b"hdlr", 0, 0, struct.pack(">I", 0), handler, b"\x00" * 12, name + b"\x00")
+        dinf = _box(b"dinf", _full_box(b"dref", 0, 0, struct.pack(">I", 1), _full_box(b"url ", 0, 1)))
+        stbl = _box(
+            b"stbl",
+            _full_box(b"stsd", 0, 0, struct.pack(">I", 1), sample_entry),
+            _full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+            _full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+            _full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+            _full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+        )
+        minf = _box(b"minf", media_header, dinf, stbl)
+        return _box(b"trak", tkhd, _box(b"mdia", mdhd, hdlr, minf))
+
+    def _video_trak(self) -> bytes:
+        avc1 = _box(
+            b"avc1",
+            b"\x00" * 6, struct.pack(">H", 1), b"\x00" * 16,
+            struct.pack(">HHII", self.width, self.height, 0x00480000, 0x00480000),
+            struct.pack(">IH", 0, 1), b"\x00" * 32, struct.pack(">Hh", 0x0018, -1),
+            _box(b"avcC", self.avc_config),
+        )
+        vmhd = _full_box(b"vmhd", 0, 1, b"\x00" * 8)
+        return self._trak(VIDEO_TRACK_ID, VIDEO_TIMESCALE, b"vide", b"VideoHandler", vmhd, avc1, 0, self.width, self.height)
+
+    def _audio_trak(self) -> bytes:
+        asc = self.audio_config
+        decoder_specific = b"\x05" + bytes([len(asc)]) + asc
+        decoder_config = b"\x04" + bytes([13 + len(decoder_specific)]) + bytes([0x40, 0x15]) + b"\x00" * 11 + decoder_specific
+        sl_config = b"\x06\x01\x02"
+        es = b"\x03" + bytes([3 + len(decoder_config) + len(sl_config)]) + struct.pack(">HB", AUDIO_TRACK_ID, 0) + decoder_config + sl_config
+        mp4a = _box(
+            b"mp4a",
+            b"\x00" * 6, struct.pack(">H", 1), b"\x00" * 8,
+            struct.pack(">HHHH", self.channels, 16, 0, 0), struct.pack(">I", (self.sample_rate & 0xFFFF) << 16),
+            _full_box(b"esds", 0, 0, es),
+        )
+        smhd = _full_box(b"smhd", 0, 0, b"\x00" * 4)
+        return self._trak(AUDIO_TRACK_ID, self.sample_rate, b"soun", b"SoundHandler", smhd, mp4a, 0x0100, 0, 0)
+
+    def _traf(self, track_id: int, decode_time: int, trun_flags: int, entries: list[bytes], data_offset: int) -> bytes:
+        tfhd = _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id))
+        tfdt = _full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time))
+        trun = _full_box(b"trun", 1, trun_flags, struct.pack(">Ii", len(entries), data_offset), *entries)
+        return _box(b"traf", tfhd, tfdt, trun)
+
+    def _flush(self, next_dts: Optional[int]) -> None:
+        """把已缓存的样本写成一个moof+mdat分片"""
+        if not self.video_samples and not self.audio_samples:
+            return
+        if not self.init_written:
+            if not self.avc_config and not self.audio_config:
+                raise UnsupportedFlvCodec("FLV中没有找到音视频编码信息")
+            self._end_probe()
+            self._write(self._init_segment())
+            self.init_written = True
+
+        video = self.video_samples if self.avc_config else []
+        audio = self.audio_samples if self.audio_config else []
+        for sample, following in zip(video, video[1:]):
+            sample.duration = max(0, following.dts - sample.dts)
+        if video:
+            last = video[-1]
+            last.duration = max(0, next_dts - last.dts) if next_dts is not None else self.last_video_duration
+            self.last_video_duration = last.duration or self.last_video_duration
+
+        video_entries = [
+            struct.pack(">IIIi", s.duration, len(s.data), SAMPLE_FLAGS_SYNC if s.keyframe else SAMPLE_FLAGS_NON_SYNC, s.cts)
+            for s in video
+        ]
+        audio_entries = [struct.pack(">III", AAC_FRAME_SAMPLES, len(a), SAMPLE_FLAGS_SYNC) for a in audio]
+        video_bytes = sum(len(s.data) for s in video)
+
+        self.sequence += 1
+
+        def build_moof(video_offset: int, audio_offset: int) -> bytes:
+            trafs = []
+            if video:
+                video_time = video[0].dts - self.base_dts
+                trafs.append(self._traf(VIDEO_TRACK_ID, max(0, video_time), 0x000F01, video_entries, video_offset))
+            if audio:
+                trafs.append(self._traf(AUDIO_TRACK_ID, max(0, self.audio_decode_time), 0x000701, audio_entries, audio_offset))
+            return _box(b"moof", _full_box(b"mfhd", 0, 0, struct.pack(">I", self.sequence)), *trafs)
+
+        moof_size = len(build_moof(0, 0))
+        moof = build_moof(moof_size + 8, moof_size + 8 + video_bytes)
+        mdat_size = 8 + video_bytes + sum(len(a) for a in audio)
+        self._write(moof)
+        self._write(struct.pack(">I", mdat_size) + b"mdat")
+        for s in video:
+            self._write(s.data)
+        for a in audio:
+            self._write(a)
+
+        if audio:
+            self.audio_decode_time += len(audio) * AAC_FRAME_SAMPLES
+        self.video_samples = []
+        self.audio_samples = []
+        self.pending_bytes = 0
+
+    def close(self) -> None:
+        """输出最后一个分片"""
+        self._flush(None)
+        if not self.init_written:
+            raise UnsupportedFlvCodec("FLV中没有可转封装的音视频数据")
+
+
+class RemuxingWriter:
+    """边下载边转封装的文件写入器, 遇到不支持的编码时自动回退为原样保存flv"""
+
+    def __init__(self, mp4_path: str, flv_path: str, log: Callable = print):
+        self.log = log
+        self.mp4_path = mp4_path
+        self.flv_path = flv_path
+        self.path = mp4_path
+        self.file = open(mp4_path, "wb")
+        self.remuxer: Optional[FlvToMp4Remuxer] = FlvToMp4Remuxer(self.file)
+
+    def _fallback(self, reason: Exception) -> bytes:
+        self.log(f"无法转封装为MP4({reason})，改为直接保存FLV")
+        raw = bytes(self.remuxer.raw_prefix)
+        self.remuxer = None
+        self.file.close()
+        os.remove(self.mp4_path)
+        self.path = self.flv_path
+        self.file = open(self.flv_path, "wb")
+        return raw
+
+    def write(self, chunk: bytes) -> None:
+        if self.remuxer is None:
+            self.file.write(chunk)
+            return
+        try:
+            self.remuxer.feed(chunk)
+        except UnsupportedFlvCodec as e:
+            if not self.remuxer.probing:
+                raise
+            raw = self._fallback(e)  # 先切换到flv文件再写入, 不能写到已关闭的mp4文件
+            self.file.write(raw)
+
+    def close(self) -> None:
+        try:
+            if self.remuxer is not None:
+                self.remuxer.close()
+        finally:
+            self.file.close()
+
+    def __enter__(self) -> "RemuxingWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            # 下载出错或被取消时文件会被丢弃, 不再输出最后的分片, 以免转封装的错误掩盖原来的异常
+            self.file.close()
+            return
+        self.close()
+
+
+def _flv_tag(tag_type: int, timestamp: int, data: bytes) -> bytes:
+    header = bytes([tag_type]) + len(data).to_bytes(3, "big") + (timestamp & 0xFFFFFF).to_bytes(3, "big")
+    header += bytes([timestamp >> 24 & 0xFF]) + b"\x00\x00\x00"
+    return header + data + struct.pack(">I", 11 + len(data))
+
+
+def run_check() -> bool:
+    """检查两个回退路径: MP3音频时改为原样保存flv; 第一个分片写出前中断时保留原来的异常"""
+    flv_header = b"FLV\x01\x05\x00\x00\x00\x09\x00\x00\x00\x00"
+    directory = tempfile.mkdtemp(prefix="flv_remux_")
+    try:
+        # sound format 2 = MP3, 应回退为flv, 内容与输入完全一致
+        data = flv_header + b"".join(_flv_tag(FLV_TAG_AUDIO, i * 26, b"\x2f" + os.urandom(200)) for i in range(50))
+        mp4_path, flv_path = os.path.join(directory, "mp3.mp4"), os.path.join(directory, "mp3.flv")
+        with RemuxingWriter(mp4_path, flv_path, log=lambda *args: None) as writer:
+            for i in range(0, len(data), 1000):
+                writer.write(data[i:i + 1000])
+        with open(flv_path, "rb") as f:
+            fallback_ok = writer.path == flv_path and not os.path.exists(mp4_path) and f.read() == data
+        print(f"MP3音频回退为FLV: {'通过' if fallback_ok else '失败'}")
+
+        # 还没有输出任何分片时中断, 应抛出原来的异常而不是UnsupportedFlvCodec
+        class Interrupted(Exception):
+            pass
+
+        raised = None
+        try:
+            with RemuxingWriter(os.path.join(directory, "cancel.mp4"), os.path.join(directory, "cancel.flv")) as writer:
+                writer.write(flv_header)
+                raise Interrupted()
+        except Exception as e:
+            raised = e
+        cancel_ok = isinstance(raised, Interrupted) and writer.file.closed
+        print(f"首个分片前中断: {'通过' if cancel_ok else f'失败 ({raised!r})'}")
+        return fallback_ok and cancel_ok
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    return 0 if run_check() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
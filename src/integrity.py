@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Callable
+
+MANIFEST_FILE = "manifest.json"
+BLOCK_SIZE = 4 * 1024 * 1024
+MAX_REFETCH = 3
+
+
+class StreamVerifier:
+    """在下载循环中增量计算大小、整体sha256和分块sha256, 不需要再读一遍文件"""
+
+    def __init__(self, expected_size: int = 0, block_size: int = BLOCK_SIZE):
+        self.expected_size = expected_size
+        self.block_size = block_size
+        self.size = 0
+        self.interrupted = False  # 最近一次连接是否在数据结束前中断
+        self._hash = hashlib.sha256()
+        self._block_hash = hashlib.sha256()
+        self._block_fill = 0
+        self.block_hashes: list[str] = []
+
+    def update(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        view = memoryview(chunk)
+        while view:
+            take = min(len(view), self.block_size - self._block_fill)
+            self._block_hash.update(view[:take])
+            self._block_fill += take
+            view = view[take:]
+            if self._block_fill == self.block_size:
+                self.block_hashes.append(self._block_hash.hexdigest())
+                self._block_hash = hashlib.sha256()
+                self._block_fill = 0
+
+    @property
+    def missing(self) -> int:
+        return max(0, self.expected_size - self.size)
+
+    @property
+    def status(self) -> str:
+        if not self.expected_size:
+            # 不知道完整大小时无法判断是否完整, 但连接中断的一定不完整
+            return "interrupted" if self.interrupted else "unverified"
+        if self.size == self.expected_size:
+            return "ok"
+        return "incomplete" if self.size < self.expected_size else "oversize"
+
+    def result(self) -> dict:
+        block_hashes = list(self.block_hashes)
+        if self._block_fill:
+            block_hashes.append(self._block_hash.hexdigest())
+        return {
+            "status": self.status,
+            "size": self.size,
+            "expected_size": self.expected_size,
+            "sha256": self._hash.hexdigest(),
+            "block_size": self.block_size,
+            "block_sha256": block_hashes,
+        }
+
+
+class IntegrityManifest:
+    """输出目录下的manifest.json, 记录每个文件的校验结果"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, directory: str, log: Callable = print):
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.log = log
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            self.log(f"读取校验清单失败: {e}")
+            return {}
+
+    def record(self, filename: str, entry: dict) -> None:
+        with self._lock:
+            manifest = self.load()
+            manifest[filename] = dict(entry, checked_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+            tmp_file = f"{self.path}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.path)
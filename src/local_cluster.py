@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import secrets
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from coordinator import Coordinator, serve
+import worker
+
+
+class StandInCdnHandler(BaseHTTPRequestHandler):
+    """模拟B站CDN: 只支持Range请求, 并限速, 让多个worker有机会并行和切分任务"""
+
+    protocol_version = "HTTP/1.1"
+    data: bytes = b""
+    bytes_per_second = 8 * 1024 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers.get("Range", "")
+        if not range_header.startswith("bytes="):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(self.data)))
+            self.end_headers()
+            body = self.data
+        else:
+            start, end = range_header[6:].split("-")
+            start, end = int(start), min(int(end or len(self.data) - 1), len(self.data) - 1)
+            body = self.data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(self.data)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+        chunk = 256 * 1024
+        try:
+            for i in range(0, len(body), chunk):
+                self.wfile.write(body[i:i + chunk])
+                time.sleep(chunk / self.bytes_per_second)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_cdn(data: bytes, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("Handler", (StandInCdnHandler,), {"data": data})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _HungWorker(worker.DownloadWorker):
+    """领取一个任务后不再发送心跳, 用来验证租约过期后任务会交给其他worker"""
+
+    def _call(self, path: str, payload: dict) -> dict:
+        if path == "/heartbeat":
+            threading.Event().wait()
+        return super()._call(path, payload)
+
+
+def run_check(workers: int = 3, size: int = 48 * 1024 * 1024, range_size: int = 16 * 1024 * 1024,
+              lease_ttl: int = 3, output_dir: str = "") -> bool:
+    """在本机启动模拟CDN、协调器和多个worker下载一个文件, 检查内容、租约过期和任务切分"""
+    data = os.urandom(size)
+    cleanup = not output_dir
+    output_dir = output_dir or tempfile.mkdtemp(prefix="bili_cluster_")
+    token = secrets.token_urlsafe(16)
+    cdn = start_cdn(data)
+    coordinator = Coordinator(range_size=range_size, lease_ttl=lease_ttl)
+    server = serve(token, "127.0.0.1", 0, coordinator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    worker.HEARTBEAT_INTERVAL = 0.5
+    worker.IDLE_INTERVAL = 0.2
+
+    try:
+        coordinator.submit({
+            "url": f"http://127.0.0.1:{cdn.server_address[1]}/video.flv",
+            "size": size,
+            "path": os.path.join("cluster", "video", "video.flv"),
+            "headers": {},
+        })
+        hung = _HungWorker(url, "hung", output_dir, token=token)
+        threading.Thread(target=hung.run_once, daemon=True).start()
+        time.sleep(0.5)
+
+        threads = [
+            threading.Thread(target=worker.DownloadWorker(url, f"worker-{i}", output_dir, token=token).run, args=(True,))
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        status = coordinator.status()
+        path = os.path.join(output_dir, "cluster", "video", "video.flv")
+        with open(path, "rb") as f:
+            matches = hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest()
+        print(f"内容一致: {matches}, 租约过期: {status['expired_leases']} 次, 任务切分: {status['stolen_ranges']} 次")
+        print(f"已确认写入: {status['files'][0]['completed_bytes']}/{size} 字节")
+        return (matches and status["expired_leases"] >= 1 and status["stolen_ranges"] >= 1
+                and status["files"][0]["completed_bytes"] == size)
+    finally:
+        server.shutdown()
+        cdn.shutdown()
+        if cleanup:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本机用模拟CDN验证分布式下载")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--size-mb", type=int, default=48)
+    parser.add_argument("--output", default="", help="保留下载结果的目录, 默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+    ok = run_check(args.workers, args.size_mb * 1024 * 1024, output_dir=args.output)
+    print("通过" if ok else "失败")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
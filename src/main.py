@@ -1,6 +1,17 @@
+import os
 from cookie import BilibiliQRLogin
 from video_download import BiliVideoDownloader
 from comments import BiliCommentsFetcher
+from danmaku import BiliDanmakuDownloader
+from account_pool import AccountPool
+from cookie_refresh import CookieRefresher
+from quality_policy import QualityPolicy
+from pipeline import DownloadPipeline
+from metadata_crawler import MetadataCrawler
+from profiling import MODES, make_profiler
+import time
+
+profile_mode = ""
 
 def main_menu():
     print("""
@@ -30,6 +41,9 @@ def user_menu():
           4. 转换为Playwright格式Cookie
           5. 注销登录
           6. 上一步
+          7. 添加账号到账号池
+          8. 显示账号池状态
+          9. 检查并刷新Cookie
           q. 退出
           =======================================""")
     choice = input("请输入选项：").strip().lower()
@@ -57,40 +71,132 @@ def user_menu():
         else:
             print("当前未登录")
         user_menu()
+    elif choice == "7":
+        name = input("请输入账号名称: ").strip()
+        if name:
+            AccountPool(include_default=False).add_account(name)
+        user_menu()
+    elif choice == "8":
+        pool = AccountPool()
+        pool.check()
+        pool.show()
+        user_menu()
+    elif choice == "9":
+        CookieRefresher(login).check_and_refresh()
+        user_menu()
     else:
         print("输入错误，请重新输入")
      
 def video_menu():
-    print("""
+    print(f"""
           ====== Bilibili Video Downloader ======
           1. 下载视频
-          2. 下载评论
-          3. 上一步
+          2. 下载视频(自动选择画质)
+          3. 批量下载视频(自动选择画质)
+          4. 下载评论
+          5. 下载弹幕
+          6. 批量导出视频信息
+          7. 上一步
+          8. 性能分析模式 (当前: {profile_mode or "关"})
           q. 退出
           =======================================""")
     choice = input("请输入选项：").strip().lower()
     if choice == "q":
         exit()
     elif choice == "1":
-        download_video(BiliVideoDownloader())
+        download_video(BiliVideoDownloader(AccountPool.load_if_configured(), remux_flv=ask_remux()))
     elif choice == "2":
-        download_comments(BiliCommentsFetcher())
+        download_video(BiliVideoDownloader(AccountPool.load_if_configured(), quality_policy_menu(), ask_remux()))
     elif choice == "3":
+        download_batch(DownloadPipeline(BiliVideoDownloader(AccountPool.load_if_configured(), quality_policy_menu(), ask_remux())))
+    elif choice == "4":
+        download_comments(BiliCommentsFetcher())
+    elif choice == "5":
+        download_danmaku(BiliDanmakuDownloader())
+    elif choice == "6":
+        export_metadata(MetadataCrawler())
+    elif choice == "7":
         main_menu()
+    elif choice == "8":
+        toggle_profiling()
     else:
         print("输入错误，请重新输入！")
         video_menu()
     
     
+def ask_remux() -> bool:
+    return input("FLV视频是否边下载边转为MP4? (y/n): ").strip().lower() == "y"
+    
+def quality_policy_menu() -> QualityPolicy:
+    def read_number(prompt: str) -> float:
+        while True:
+            text = input(prompt).strip()
+            if not text:
+                return 0
+            try:
+                return float(text)
+            except ValueError:
+                print("请输入数字或直接回车跳过")
+    
+    max_mb_per_minute = read_number("每分钟视频最多多少MB (回车不限制): ")
+    deadline_minutes = read_number("需要在多少分钟内下载完 (回车不限制): ")
+    max_quality = int(read_number("最高画质qn, 如80=1080P, 64=720P (回车不限制): "))
+    policy = QualityPolicy(
+        max_mb_per_minute=max_mb_per_minute or None,
+        deadline=time.time() + deadline_minutes * 60 if deadline_minutes else None,
+        max_quality=max_quality or None,
+    )
+    print(f"画质策略: {policy.describe()}")
+    return policy
+    
+def toggle_profiling():
+    global profile_mode
+    print("性能分析模式: 0. 关闭  1. cProfile函数耗时  2. tracemalloc内存分配  3. 定时采样(适合批量下载)")
+    choice = input("请输入选项：").strip()
+    if choice in ("0", "1", "2", "3"):
+        profile_mode = ("", *MODES)[int(choice)]
+        print(f"性能分析模式: {profile_mode or '关'}, 报告在下载或评论结束后生成")
+    video_menu()
+    
 def download_video(downloader: BiliVideoDownloader):
-    downloader.run()
+    with make_profiler(profile_mode) as profiler:
+        downloader.profiler = profiler
+        downloader.run()
+    video_menu()
+    
+def download_batch(pipeline: DownloadPipeline):
+    with make_profiler(profile_mode) as profiler:
+        pipeline.downloader.profiler = profiler
+        pipeline.run()
     video_menu()
     
 def download_comments(fetcher: BiliCommentsFetcher):
-    fetcher.run()
+    with make_profiler(profile_mode) as profiler:
+        fetcher.profiler = profiler
+        fetcher.run()
     video_menu()
     
+def download_danmaku(downloader: BiliDanmakuDownloader):
+    downloader.run()
+    video_menu()
+    
+def export_metadata(crawler: MetadataCrawler):
+    crawler.run()
+    video_menu()
+    
+def start_cookie_refreshers(login: BilibiliQRLogin):
+    """默认账号和账号池中的每个账号各用一个后台线程刷新Cookie"""
+    if os.path.exists(login.cookie_file):
+        CookieRefresher(login).start()
+    pool = AccountPool.load_if_configured()
+    if pool is None:
+        return
+    for account in pool.accounts:
+        if account.name != "default" and os.path.exists(account.login.refresh_token_file):
+            CookieRefresher(account.login).start()
+
 def main():
+    start_cookie_refreshers(BilibiliQRLogin())
     main_menu()
 
 if __name__ == "__main__":
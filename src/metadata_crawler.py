@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from tqdm import tqdm
+from video_download import BiliVideoDownloader, HEADERS, VIDEO_DATA_INTERFACE
+from account_pool import AccountPool, RISK_CONTROL_CODES, RISK_CONTROL_STATUS
+
+EXPORT_DIR = os.path.join("bilibili_downloads", "metadata")
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 5
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 2
+FLUSH_EVERY = 100
+
+
+class RetryableError(Exception):
+    pass
+
+
+class PermanentError(Exception):
+    pass
+
+
+class TokenBucket:
+    """令牌桶限速, 多个线程共享"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class SqliteSink:
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                bvid TEXT PRIMARY KEY,
+                aid INTEGER,
+                title TEXT,
+                up TEXT,
+                up_url TEXT,
+                pages_number INTEGER,
+                pages TEXT
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                bvid TEXT,
+                page_number INTEGER,
+                cid INTEGER,
+                page_title TEXT,
+                duration INTEGER,
+                PRIMARY KEY (bvid, page_number)
+            )""")
+
+    def write(self, record: dict) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record["bvid"], record["aid"], record["title"], record["up"], record["up_url"],
+             record["pages_number"], json.dumps(record["pages"], ensure_ascii=False)),
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+            [(record["bvid"], p["page_number"], p["cid"], p["page_title"], p["duration"]) for p in record["pages"]],
+        )
+
+    def flush(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+class Checkpoint:
+    """已处理的BV号, 每行一个; 失效的视频也记录在内, 续传时不再请求"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.done = {line.split("\t", 1)[0] for line in f if line.strip()}
+        self.f = open(path, "a", encoding="utf-8")
+
+    def mark(self, entries: list[tuple[str, str]]) -> None:
+        for bvid, status in entries:
+            self.f.write(f"{bvid}\t{status}\n")
+            self.done.add(bvid)
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class MetadataCrawler:
+    """批量获取视频信息并导出为JSONL或SQLite, 支持限速、重试和断点续传"""
+
+    def __init__(self, downloader: BiliVideoDownloader = None, rate: float = REQUESTS_PER_SECOND,
+                 max_workers: int = MAX_WORKERS, max_retries: int = MAX_RETRIES):
+        self.downloader = downloader or BiliVideoDownloader(AccountPool.load_if_configured())
+        self.bucket = TokenBucket(rate, burst=max_workers)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+    def read_inputs(self, paths: list[str]) -> list[str]:
+        """从BV列表文件读取BV号或视频链接, 去重并保持顺序"""
+        bvids: dict[str, None] = {}
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    text = line.strip()
+                    if not text:
+                        continue
+                    bv = self.downloader._bv_parser(text)
+                    if bv:
+                        bvids[bv.removeprefix("bvid=")] = None
+                    else:
+                        print(f"无法识别的BV/URL: {text}")
+        return list(bvids)
+
+    def _fetch_once(self, bvid: str) -> dict:
+        self.bucket.acquire()
+        try:
+            response = self.downloader._get(f"{VIDEO_DATA_INTERFACE}bvid={bvid}", headers=HEADERS, timeout=10)
+        except (requests.RequestException, RuntimeError) as e:  # RuntimeError: 账号池中的账号都被风控
+            raise RetryableError(str(e))
+        if response.status_code in RISK_CONTROL_STATUS or response.status_code >= 500:
+            raise RetryableError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise PermanentError(f"http_{response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            # 风控时接口可能返回HTML验证页面, 稍后重试
+            raise RetryableError("响应不是JSON")
+        if not isinstance(data, dict):
+            raise PermanentError("invalid_response")
+        if data.get("code") in RISK_CONTROL_CODES:
+            raise RetryableError(f"风控 {data.get('code')}")
+        return data
+
+    def fetch(self, bvid: str) -> tuple[str, dict]:
+        """返回 (状态, 视频信息); 状态为ok, 接口错误码, 或retry表示重试次数用完"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                data = self._fetch_once(bvid)
+            except PermanentError as e:
+                return str(e), {}
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    tqdm.write(f"{bvid} 重试{self.max_retries}次后仍失败: {e}")
+                    return "retry", {}
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            if data.get("code") != 0 or not data.get("data"):
+                # -404 视频不存在, 62002 稿件不可见, 62004 审核中, 重试也不会成功
+                return str(data.get("code")), {}
+            return "ok", self.downloader._parse_video_data(data["data"])
+        return "retry", {}
+
+    def crawl(self, bvids: list[str], sink, checkpoint: Checkpoint) -> dict:
+        todo = [bvid for bvid in bvids if bvid not in checkpoint.done]
+        stats = {"ok": 0, "missing": 0, "retry": 0, "error": 0, "skipped": len(bvids) - len(todo)}
+        if stats["skipped"]:
+            print(f"跳过已完成的 {stats['skipped']} 个视频")
+        buffered: list[tuple[str, str]] = []
+
+        def flush():
+            sink.flush()
+            checkpoint.mark(buffered)  # 先写数据再记进度, 中断时最多重复请求, 不会漏
+            buffered.clear()
+
+        queue = iter(todo)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, tqdm(total=len(todo), unit="个") as pbar:
+            # 只保持有限个请求在途, 几万个BV也不会一次性创建全部Future
+            running = {executor.submit(self.fetch, bvid): bvid for bvid in _take(queue, self.max_workers * 2)}
+            try:
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        bvid = running.pop(future)
+                        pbar.update(1)
+                        try:
+                            status, record = future.result()
+                        except Exception as e:
+                            # 单个视频的意外错误不影响整批, 不记入进度, 下次运行重新获取
+                            tqdm.write(f"{bvid} 处理失败: {e}")
+                            stats["error"] += 1
+                            continue
+                        if status == "retry":
+                            stats["retry"] += 1
+                            continue
+                        if status == "ok":
+                            sink.write(record)
+                            stats["ok"] += 1
+                        else:
+                            stats["missing"] += 1
+                        buffered.append((bvid, status))
+                        if len(buffered) >= FLUSH_EVERY:
+                            flush()
+                    for bvid in _take(queue, len(done)):
+                        running[executor.submit(self.fetch, bvid)] = bvid
+            except KeyboardInterrupt:
+                print("\n已中断, 下次运行将从断点继续")
+                for future in running:
+                    future.cancel()
+            finally:
+                flush()
+        return stats
+
+    def export(self, input_paths: list[str], output: str, fmt: str = "") -> dict:
+        fmt = fmt or ("sqlite" if output.endswith((".db", ".sqlite", ".sqlite3")) else "jsonl")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        bvids = self.read_inputs(input_paths)
+        pool = self.downloader.account_pool
+        if pool is not None:
+            available = pool.check()
+            print(f"已启用账号池, 可用账号: {available}/{len(pool)}")
+            if not available:
+                print("账号池中没有已登录的账号, 改用默认会话")
+                self.downloader.account_pool = None
+        print(f"共 {len(bvids)} 个视频, 导出到 {output} ({fmt})")
+        sink = SqliteSink(output) if fmt == "sqlite" else JsonlSink(output)
+        checkpoint = Checkpoint(f"{output}.done")
+        try:
+            stats = self.crawl(bvids, sink, checkpoint)
+        finally:
+            sink.close()
+            checkpoint.close()
+        print(f"完成 {stats['ok']} 个, 失效 {stats['missing']} 个, 重试失败 {stats['retry']} 个, "
+              f"出错 {stats['error']} 个, 跳过 {stats['skipped']} 个")
+        if stats["retry"] or stats["error"]:
+            print("重试失败和出错的视频未记入进度, 重新运行即可继续")
+        return stats
+
+    def run(self):
+        self.downloader.is_logged_in()
+        while True:
+            text = input("输入BV列表文件路径, 多个用空格分隔(输入q退出):\n").strip()
+            if text.lower() == 'q':
+                return
+            paths = text.split()
+            missing = [path for path in paths if not os.path.isfile(path)]
+            if not paths or missing:
+                print(f"文件不存在: {' '.join(missing)}")
+                continue
+            name = input("导出文件名, 以.db结尾导出为SQLite (回车默认metadata.jsonl): ").strip() or "metadata.jsonl"
+            self.export(paths, os.path.join(EXPORT_DIR, name))
+
+
+def _take(iterator, n: int) -> list:
+    return [item for _, item in zip(range(n), iterator)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导出视频信息")
+    parser.add_argument("inputs", nargs="+", help="BV列表文件, 每行一个BV号或视频链接")
+    parser.add_argument("-o", "--output", default=os.path.join(EXPORT_DIR, "metadata.jsonl"))
+    parser.add_argument("--format", choices=("jsonl", "sqlite"), default="")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="每秒最多请求数")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+    MetadataCrawler(rate=args.rate, max_workers=args.workers).export(args.inputs, args.output, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import queue
+import threading
+from video_download import BiliVideoDownloader
+from quality_policy import QualityPolicy
+
+PIPELINE_DEPTH = 2
+ESTIMATED_VIDEO_SECONDS = 300  # 批量任务开始时每个视频的估计时长, 获取到视频信息后替换为实际时长
+_DONE = object()
+
+
+class DownloadPipeline:
+    """三段流水线: 解析BV并获取视频信息 -> 获取下载链接 -> 下载
+
+    每一段通过有界队列最多领先下一段 depth 个任务, 下载当前视频时下一个视频的
+    接口请求已经在进行, 同时避免提前太多导致下载链接过期
+    """
+
+    def __init__(self, downloader: BiliVideoDownloader = None, depth: int = PIPELINE_DEPTH):
+        self.downloader = downloader or BiliVideoDownloader()
+        if self.downloader.quality_policy is None:
+            # 后台解析无法交互选择画质, 默认选择可用的最高画质
+            self.downloader.quality_policy = QualityPolicy()
+        self.depth = depth
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _metadata_stage(self, inputs: list[str]) -> None:
+        try:
+            for text in inputs:
+                if self._stop.is_set():
+                    return
+                bv = self.downloader._bv_parser(text)
+                if not bv:
+                    print(f"无法识别的BV/URL: {text}")
+                    self.downloader.quality_policy.plan([], replaces=ESTIMATED_VIDEO_SECONDS)
+                    continue
+                self.downloader._reload_cookies_if_changed()
+                video_data = self.downloader._video_data_get(bv)
+                if not video_data:
+                    print(f"获取视频信息失败: {text}")
+                    self.downloader.quality_policy.plan([], replaces=ESTIMATED_VIDEO_SECONDS)
+                    continue
+                print(f"[信息] {video_data['title']} ({video_data['pages_number']}P)")
+                self.downloader.quality_policy.plan(
+                    [page.get("duration", 0) for page in video_data["pages"]], replaces=ESTIMATED_VIDEO_SECONDS
+                )
+                if not self._put(self.metadata_queue, (bv, video_data)):
+                    return
+        finally:
+            self._put(self.metadata_queue, _DONE)
+
+    def _resolve_stage(self) -> None:
+        try:
+            while not self._stop.is_set():
+                item = self._get(self.metadata_queue)
+                if item is _DONE:
+                    return
+                bv, video_data = item
+                for page_index in range(len(video_data["pages"])):
+                    info = self.downloader._resolve_page(video_data, bv, page_index)
+                    if info and not self._put(self.download_queue, (video_data, info)):
+                        return
+        finally:
+            self._put(self.download_queue, _DONE)
+
+    def run_batch(self, inputs: list[str]) -> int:
+        """下载一组视频的全部分P, 返回处理的分P数"""
+        self._stop.clear()
+        # 先按估计时长登记整批任务, 第一个视频就只分到deadline的一部分, 而不是全部
+        self.downloader.quality_policy.reset()
+        self.downloader.quality_policy.plan([ESTIMATED_VIDEO_SECONDS] * len(inputs))
+        self.metadata_queue: queue.Queue = queue.Queue(maxsize=self.depth)
+        self.download_queue: queue.Queue = queue.Queue(maxsize=self.depth)
+        workers = [
+            threading.Thread(target=self._metadata_stage, args=(inputs,), name="pipeline-metadata", daemon=True),
+            threading.Thread(target=self._resolve_stage, name="pipeline-resolve", daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        count = 0
+        try:
+            while True:
+                item = self.download_queue.get()
+                if item is _DONE:
+                    break
+                video_data, info = item
+                self.downloader._download_video(video_data, [info])
+                count += 1
+        except KeyboardInterrupt:
+            print("\n已取消批量下载")
+        finally:
+            self._stop.set()
+            for worker in workers:
+                worker.join(timeout=5)
+        return count
+
+    def run(self):
+        self.downloader.is_logged_in()
+        if self.downloader.account_pool is not None:
+            print(f"已启用账号池, 可用账号: {self.downloader.account_pool.check()}/{len(self.downloader.account_pool)}")
+        print(f"画质策略: {self.downloader.quality_policy.describe()}")
+        while True:
+            text = input("输入多个视频BV/URL(空格分隔)或BV列表文件路径(输入q退出):\n").strip()
+            if text.lower() == 'q':
+                return
+            if os.path.isfile(text):
+                with open(text, "r", encoding="utf-8") as f:
+                    inputs = [line.strip() for line in f if line.strip()]
+            else:
+                inputs = text.split()
+            if not inputs:
+                continue
+            count = self.run_batch(inputs)
+            print(f"\n批量下载完成, 共处理 {count} 个分P")
+
+
+def main():
+    DownloadPipeline().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+PROFILES_DIR = os.path.join("bilibili_downloads", "profiles")
+MODES = ("cprofile", "tracemalloc", "sample")
+TOP_N = 15
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+SNAPSHOT_LIMIT = 5  # 每个阶段最多对比几次快照, 每次快照都要遍历全部已分配的内存块
+
+
+class NullProfiler:
+    """默认的空实现, 不开启性能分析时各阶段没有额外开销"""
+
+    enabled = False
+
+    class _NullStage:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    _null_stage = _NullStage()
+
+    def stage(self, name: str):
+        return self._null_stage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage:
+    def __init__(self, profiler: "StageProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._exit(self.name)
+        return False
+
+
+class StageProfiler:
+    """按阶段(metadata/resolve/transfer/persist等)统计耗时, 并用cProfile、tracemalloc或定时采样
+    找出每个阶段最耗时的函数和分配内存最多的位置
+
+    每个阶段都会记录墙钟时间和线程CPU时间, 两者之差基本就是等待网络和磁盘的时间
+    """
+
+    enabled = True
+
+    def __init__(self, mode: str = "cprofile", output_dir: str = PROFILES_DIR, top_n: int = TOP_N):
+        if mode not in MODES:
+            raise ValueError(f"未知的分析模式: {mode}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.calls: Counter = Counter()
+        self.wall: Counter = Counter()
+        self.cpu: Counter = Counter()
+        self.profiles: dict[str, list] = defaultdict(list)
+        self.profile_skipped: Counter = Counter()
+        self.alloc_sites: dict[str, Counter] = defaultdict(Counter)
+        self.alloc_peak: Counter = Counter()
+        self.alloc_net: Counter = Counter()
+        self.snapshots: Counter = Counter()
+        self.overlapped: Counter = Counter()
+        self._entries = 0
+        self.self_samples: dict[str, Counter] = defaultdict(Counter)
+        self.total_samples: dict[str, Counter] = defaultdict(Counter)
+        self._active: dict[int, str] = {}
+        self._sampler: threading.Thread = None
+        self._stop = threading.Event()
+        self.started_at = 0.0
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def _frames(self) -> list:
+        if not hasattr(self._local, "frames"):
+            self._local.frames = []
+        return self._local.frames
+
+    def _enter(self, name: str) -> None:
+        frames = self._frames()
+        if frames and frames[-1]["name"] == name:
+            frames[-1]["depth"] += 1  # 同一阶段嵌套调用只算一次
+            return
+        if frames:
+            self._pause(frames[-1])
+        frame = {"name": name, "depth": 1, "wall": time.perf_counter(), "cpu": time.thread_time(), "profile": None}
+        self._resume(frame)
+        frames.append(frame)
+
+    def _exit(self, name: str) -> None:
+        frames = self._frames()
+        frame = frames[-1]
+        frame["depth"] -= 1
+        if frame["depth"]:
+            return
+        frames.pop()
+        self._pause(frame)
+        with self._lock:
+            self.calls[name] += 1
+        if frames:
+            self._resume(frames[-1])
+
+    def _resume(self, frame: dict) -> None:
+        """开始或继续统计某个阶段; 外层阶段在内层阶段运行期间暂停"""
+        frame["wall"] = time.perf_counter()
+        frame["cpu"] = time.thread_time()
+        name = frame["name"]
+        with self._lock:
+            # 记录这段时间内是否有其他线程也在某个阶段中, 此时tracemalloc的数据混有其他线程的分配
+            frame["overlapped"] = bool(self._active)
+            self._active[threading.get_ident()] = name
+            self._entries += 1
+            frame["entries"] = self._entries
+        if self.mode == "cprofile":
+            # 每个线程的每个阶段只用一个Profile, 多次进入时继续累计
+            profiles = self._local.__dict__.setdefault("profiles", {})
+            profile = profiles.get(name)
+            if profile is None:
+                profile = profiles[name] = cProfile.Profile()
+                with self._lock:
+                    self.profiles[name].append(profile)
+            try:
+                profile.enable()
+                frame["profile"] = profile
+            except ValueError:
+                # Python 3.12起同一时间只能有一个cProfile在运行, 多线程并行的阶段只记录耗时
+                frame["profile"] = None
+                with self._lock:
+                    self.profile_skipped[name] += 1
+        elif self.mode == "tracemalloc" and not frame["overlapped"]:
+            frame["traced"] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            if self.snapshots[name] < SNAPSHOT_LIMIT:
+                frame["snapshot"] = _take_snapshot()
+
+    def _pause(self, frame: dict) -> None:
+        name = frame["name"]
+        wall = time.perf_counter() - frame["wall"]
+        cpu = time.thread_time() - frame["cpu"]
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            overlapped = frame["overlapped"] or self._entries != frame["entries"]
+            if overlapped:
+                self.overlapped[name] += 1
+        if self.mode == "cprofile" and frame["profile"] is not None:
+            frame["profile"].disable()
+            frame["profile"] = None
+        elif self.mode == "tracemalloc":
+            snapshot = frame.pop("snapshot", None)
+            traced = frame.pop("traced", None)
+            if not overlapped and traced is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                diff = _take_snapshot().compare_to(snapshot, "lineno") if snapshot is not None else []
+                with self._lock:
+                    self.alloc_peak[name] = max(self.alloc_peak[name], peak - traced)
+                    self.alloc_net[name] += current - traced
+                    if snapshot is not None:
+                        self.snapshots[name] += 1
+                    for stat in diff:
+                        if stat.size_diff > 0:
+                            self.alloc_sites[name][str(stat.traceback[0])] += stat.size_diff
+        with self._lock:
+            self.wall[name] += wall
+            self.cpu[name] += cpu
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            for thread_id, name in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own:
+                    continue
+                self.self_samples[name][_describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _describe_function(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        self.total_samples[name][key] += 1
+                    frame = frame.f_back
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        if self.mode == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        elif self.mode == "sample":
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        if self.mode == "tracemalloc" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        elif self.mode == "sample" and self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def report(self) -> str:
+        out = io.StringIO()
+        out.write(f"性能分析报告 ({self.mode}) {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))}\n\n")
+        out.write(f"{'阶段':<12}{'次数':>8}{'总耗时(s)':>12}{'CPU(s)':>10}{'等待(s)':>10}\n")
+        for name in self.calls:
+            out.write(f"{name:<12}{self.calls[name]:>8}{self.wall[name]:>12.3f}{self.cpu[name]:>10.3f}"
+                      f"{max(0.0, self.wall[name] - self.cpu[name]):>10.3f}\n")
+
+        for name in self.calls:
+            out.write(f"\n===== {name} =====\n")
+            if self.mode == "cprofile":
+                if self.profile_skipped[name]:
+                    out.write(f"有 {self.profile_skipped[name]} 次因其他线程正在分析而只记录了耗时, 多线程时建议使用sample模式\n")
+                if self.profiles[name]:
+                    stats = pstats.Stats(*self.profiles[name], stream=out)
+                    stats.sort_stats("tottime").print_stats(self.top_n)
+            elif self.mode == "tracemalloc":
+                if self.overlapped[name]:
+                    # tracemalloc和reset_peak()都是整个进程范围的, 无法区分线程
+                    out.write(f"有 {self.overlapped[name]} 次与其他线程的阶段同时运行, 未计入内存统计, "
+                              f"多线程时建议使用sample模式\n")
+                out.write(f"单次最大新增内存峰值: {self.alloc_peak[name] / 1024 / 1024:.1f} MiB, "
+                          f"累计净增: {self.alloc_net[name] / 1024 / 1024:.1f} MiB\n")
+                if self.snapshots[name]:
+                    out.write(f"分配位置 (前 {self.snapshots[name]} 次进入该阶段):\n")
+                for site, size in self.alloc_sites[name].most_common(self.top_n):
+                    out.write(f"{size / 1024:>12.1f} KiB  {site}\n")
+            else:
+                total = sum(self.self_samples[name].values()) or 1
+                out.write(f"采样 {total} 次, 自身耗时:\n")
+                for key, count in self.self_samples[name].most_common(self.top_n):
+                    out.write(f"{count / total:>8.1%}  {key}\n")
+                out.write("包含子调用:\n")
+                for key, count in self.total_samples[name].most_common(self.top_n):
+                    out.write(f"{count / total:>8.1%}  {key}\n")
+        return out.getvalue()
+
+    def save_report(self) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        path = os.path.join(self.output_dir, f"profile_{stamp}_{self.mode}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+        if self.mode == "cprofile":
+            # 每个阶段的原始数据, 可以用snakeviz等工具查看
+            for name, profiles in self.profiles.items():
+                pstats.Stats(*profiles).dump_stats(os.path.join(self.output_dir, f"profile_{stamp}_{name}.prof"))
+        return path
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        if self.calls:
+            print(f"性能分析报告已保存到 {self.save_report()}")
+        return False
+
+
+def _take_snapshot():
+    # 去掉tracemalloc和分析器自身的分配
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+def _describe(frame) -> str:
+    return f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})"
+
+
+def _describe_function(frame) -> str:
+    return f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_code.co_firstlineno})"
+
+
+def make_profiler(mode: str = ""):
+    return StageProfiler(mode) if mode else NullProfiler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以性能分析模式运行下载或评论")
+    parser.add_argument("command", choices=("download", "comments"))
+    parser.add_argument("--mode", choices=MODES, default="cprofile")
+    args = parser.parse_args()
+    if args.command == "download":
+        from video_download import BiliVideoDownloader
+        target = BiliVideoDownloader()
+    else:
+        from comments import BiliCommentsFetcher
+        target = BiliCommentsFetcher()
+    with StageProfiler(args.mode) as profiler:
+        target.profiler = profiler
+        target.run()
+
+
+if __name__ == "__main__":
+    main()
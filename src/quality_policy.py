@@ -0,0 +1,147 @@
+import time
+import threading
+from typing import Optional
+
+# playurl 的 fnval: 16 = DASH, 64 = HDR, 128 = 4K, 256 = 杜比音频, 512 = 杜比视界, 1024 = 8K, 2048 = AV1
+FNVAL_DASH_ALL = 4048
+
+CODEC_NAMES = {7: "avc", 12: "hevc", 13: "av1"}
+DURL_CODEC_ID = 7  # durl(flv/mp4单文件)流只有AVC编码
+BOOTSTRAP_BYTES_PER_SECOND = 2 * 1024 * 1024  # 还没有实测带宽时按此速度估算deadline预算
+
+
+class ThroughputMeter:
+    """下载速度的指数加权移动平均 (字节/秒)"""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.bytes_per_second = 0.0
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def update(self, nbytes: int, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self._lock:
+            self.total_bytes += nbytes
+            if self.bytes_per_second == 0:
+                self.bytes_per_second = rate
+            else:
+                self.bytes_per_second += self.alpha * (rate - self.bytes_per_second)
+
+    @property
+    def measured(self) -> bool:
+        return self.bytes_per_second > 0
+
+
+class StreamCandidate:
+    __slots__ = ("quality", "codecid", "bandwidth", "size")
+
+    def __init__(self, quality: int, codecid: int, bandwidth: int, size: int):
+        self.quality = quality
+        self.codecid = codecid
+        self.bandwidth = bandwidth
+        self.size = size
+
+    @property
+    def codec(self) -> str:
+        return CODEC_NAMES.get(self.codecid, str(self.codecid))
+
+    def __repr__(self) -> str:
+        return f"StreamCandidate(qn={self.quality}, codec={self.codec}, size={self.size})"
+
+
+def stream_candidates(playurl_data: dict) -> list[StreamCandidate]:
+    """从DASH格式的playurl响应估算每个画质/编码的文件大小 (视频码率 + 最高音频码率)"""
+    dash = playurl_data.get("dash") or {}
+    duration = dash.get("duration") or (playurl_data.get("timelength", 0) / 1000)
+    accepted = set(playurl_data.get("accept_quality") or [])
+    audio_bandwidth = max((a.get("bandwidth", 0) for a in dash.get("audio") or []), default=0)
+
+    candidates: dict[tuple[int, int], StreamCandidate] = {}
+    for video in dash.get("video") or []:
+        quality, codecid = video.get("id", 0), video.get("codecid", 0)
+        if accepted and quality not in accepted:
+            continue
+        bandwidth = video.get("bandwidth", 0) + audio_bandwidth
+        size = int(bandwidth / 8 * duration)
+        key = (quality, codecid)
+        if key not in candidates or size < candidates[key].size:
+            candidates[key] = StreamCandidate(quality, codecid, bandwidth, size)
+    return list(candidates.values())
+
+
+class QualityPolicy:
+    """根据规则和实测带宽自动选择画质
+
+    max_mb_per_minute: 每分钟视频最多允许的MB数
+    deadline: 整批任务需要完成的时间戳, 结合实测带宽换算成每个分P的字节预算
+    bootstrap_bytes_per_second: 第一个分P下载前还没有实测带宽, deadline预算按这个速度估算
+    """
+
+    def __init__(self, max_mb_per_minute: Optional[float] = None, deadline: Optional[float] = None,
+                 max_quality: Optional[int] = None, bootstrap_bytes_per_second: float = BOOTSTRAP_BYTES_PER_SECOND):
+        self.max_mb_per_minute = max_mb_per_minute
+        self.deadline = deadline
+        self.max_quality = max_quality
+        self.bootstrap_bytes_per_second = bootstrap_bytes_per_second
+        self.pending_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def plan(self, durations: list, replaces: float = 0.0) -> None:
+        """登记待下载分P的时长, 用于把deadline预算按时长分配; replaces为之前登记的估计值, 拿到实际时长后扣除"""
+        with self._lock:
+            self.pending_seconds = max(0.0, self.pending_seconds + sum(durations) - replaces)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.pending_seconds = 0.0
+
+    def budget(self, duration: float, bytes_per_second: float) -> Optional[int]:
+        """当前分P允许的最大字节数, 没有任何限制时返回None"""
+        limits = []
+        if self.max_mb_per_minute:
+            limits.append(self.max_mb_per_minute * 1024 * 1024 * duration / 60)
+        bytes_per_second = bytes_per_second or self.bootstrap_bytes_per_second
+        if self.deadline and bytes_per_second > 0:
+            remaining = max(0.0, self.deadline - time.time())
+            with self._lock:
+                share = duration / self.pending_seconds if self.pending_seconds > duration else 1.0
+            limits.append(remaining * bytes_per_second * share)
+        return int(min(limits)) if limits else None
+
+    def choose(self, playurl_data: dict, bytes_per_second: float = 0.0) -> Optional[StreamCandidate]:
+        # 下载流程使用durl单文件流, 只有AVC编码, 按AVC的码率估算大小
+        candidates = [c for c in stream_candidates(playurl_data) if c.codecid == DURL_CODEC_ID]
+        if not candidates:
+            return None
+        if self.max_quality:
+            capped = [c for c in candidates if c.quality <= self.max_quality]
+            if not capped:
+                # 没有不超过上限的画质时退而选择最低画质
+                lowest = min(c.quality for c in candidates)
+                capped = [c for c in candidates if c.quality == lowest]
+            candidates = capped
+
+        dash = playurl_data.get("dash") or {}
+        duration = dash.get("duration") or playurl_data.get("timelength", 0) / 1000
+        limit = self.budget(duration, bytes_per_second)
+        with self._lock:
+            self.pending_seconds = max(0.0, self.pending_seconds - duration)
+
+        fitting = [c for c in candidates if limit is None or c.size <= limit]
+        if not fitting:
+            return min(candidates, key=lambda c: c.size)
+
+        return max(fitting, key=lambda c: (c.quality, -c.size))
+
+    def describe(self) -> str:
+        rules = []
+        if self.max_mb_per_minute:
+            rules.append(f"每分钟不超过{self.max_mb_per_minute}MB")
+        if self.deadline:
+            rules.append(f"在{time.strftime('%H:%M:%S', time.localtime(self.deadline))}前完成")
+        if self.max_quality:
+            rules.append(f"画质不超过qn={self.max_quality}")
+        return ", ".join(rules) or "最高画质"
@@ -1,35 +1,66 @@
 import re
 import os
+import time
 from tqdm import tqdm
 import requests
 from urllib.parse import urlparse, unquote
 from http.cookiejar import LWPCookieJar
+from typing import Callable, Optional
+from wbi import wbi_signer
+from account_pool import AccountPool
+from quality_policy import QualityPolicy, ThroughputMeter, FNVAL_DASH_ALL
+from flv_remux import RemuxingWriter
+from integrity import StreamVerifier, IntegrityManifest, MAX_REFETCH
+from profiling import NullProfiler
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36"
 }
 DOWNLOAD_INFO_RAW_URL = "https://api.bilibili.com/x/player/playurl?"
+WBI_PLAYURL_URL = "https://api.bilibili.com/x/player/wbi/playurl"
+PREMIUM_MIN_QN = 112  # 1080P高码率及以上需要大会员
 VIDEO_DATA_INTERFACE = "https://api.bilibili.com/x/web-interface/view?"
 
 COOKIES_DIR = "cookies"
 COOKIE_FILE = os.path.join(COOKIES_DIR, "bilibili_cookies.txt")
+DOWNLOADS_DIR = "bilibili_downloads"
+TRANSFER_TIMEOUT = (10, 30)  # (连接, 读取) 超时, 读取卡住时转入补齐缺失部分的流程
+
+
+class DownloadCancelled(Exception):
+    pass
+
 
 class BiliVideoDownloader:
-    def __init__(self):
+    def __init__(self, account_pool: Optional[AccountPool] = None, quality_policy: Optional[QualityPolicy] = None,
+                 remux_flv: bool = False, log: Optional[Callable] = None):
         self.session = requests.Session()
         self.cookie_jar = LWPCookieJar(COOKIE_FILE)
+        self.quality_policy = quality_policy
+        self.remux_flv = remux_flv
+        self.throughput = ThroughputMeter()
+        self._cookie_mtime = 0.0
+        self.account_pool = account_pool
+        self.profiler = NullProfiler()
+        self.log = log or print  # 作为库调用时可传入日志函数或静默
         self._load_cookies()
         
     def _load_cookies(self):
         os.makedirs(COOKIES_DIR, exist_ok=True)
         if os.path.exists(COOKIE_FILE):
             try:
+                self._cookie_mtime = os.path.getmtime(COOKIE_FILE)
                 self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
                 for cookie in self.cookie_jar:
                     self.session.cookies.set_cookie(cookie)
-                print("检测到已保存的Cookie文件，已加载登录状态")
+                self.log("检测到已保存的Cookie文件，已加载登录状态")
             except Exception as e:
-                print(f"加载Cookie文件出错: {e}")
+                self.log(f"加载Cookie文件出错: {e}")
+    
+    def _reload_cookies_if_changed(self):
+        """Cookie文件被后台刷新后重新加载, 无需重启"""
+        if os.path.exists(COOKIE_FILE) and os.path.getmtime(COOKIE_FILE) != self._cookie_mtime:
+            self._load_cookies()
                 
     def is_logged_in(self) -> bool:
         try:
@@ -39,6 +70,7 @@ class BiliVideoDownloader:
                 timeout=10
             )
             data = response.json()
+            wbi_signer.update_from_nav(data, self.log)
             if data.get("code") == 0 and data.get("data", {}).get("isLogin"):
                 print(f"登录状态有效! 用户名: {data['data']['uname']}")
                 return True
@@ -47,6 +79,12 @@ class BiliVideoDownloader:
         except Exception as e:
             print(f"检查登录状态失败: {e}")
             return False
+    
+    def _get(self, url: str, premium: bool = False, **kwargs):
+        """配置了账号池时由账号池分配账号, 否则使用默认会话"""
+        if self.account_pool is None:
+            return self.session.get(url, **kwargs)
+        return self.account_pool.get(url, premium=premium, **kwargs)
         
     def _bv_parser(self, text: str) -> str:
         bv_pattern = re.compile(r'^BV[0-9A-Za-z]+$')
@@ -66,18 +104,21 @@ class BiliVideoDownloader:
         json_response: dict = {}
         interface_url: str = f"https://api.bilibili.com/x/web-interface/view?{bv}"
         try:
-            raw_response = self.session.get(interface_url, headers=HEADERS)
-            raw_response.raise_for_status()
-            json_response = raw_response.json()
+            with self.profiler.stage("metadata"):
+                raw_response = self._get(interface_url, headers=HEADERS)
+                raw_response.raise_for_status()
+                json_response = raw_response.json()
         except Exception as e:
-            print(f"请求视频信息失败: {e}")
+            self.log(f"请求视频信息失败: {e}")
             return {}
         
         data: dict = json_response.get("data", {})
         if not data:
-            print("获取视频数据失败")
+            self.log("获取视频数据失败")
             return {}
-            
+        return self._parse_video_data(data)
+    
+    def _parse_video_data(self, data: dict) -> dict:
         up: dict = data.get("owner", {})
         pages: list = data.get("pages", [])
         page_list: list = []
@@ -87,6 +128,7 @@ class BiliVideoDownloader:
                 "page_number": page.get("page", 0), 
                 "cid": page.get("cid", ""),
                 "page_title": page.get("part", ""),
+                "duration": page.get("duration", 0),
             })
             
         result: dict = {
@@ -100,6 +142,27 @@ class BiliVideoDownloader:
         }
         
         return result
+    
+    def _playurl(self, bv: str, cid, headers: dict, quality: str = "", fnval: int = 0,
+                 premium: Optional[bool] = None) -> dict:
+        """请求playurl, WBI密钥可用时走签名接口; premium为None时按请求的画质决定是否使用大会员账号"""
+        params: dict = {"bvid": bv.removeprefix("bvid="), "cid": cid}
+        if quality:
+            params["qn"] = quality
+        if fnval:
+            params["fnval"] = fnval
+            params["fourk"] = 1
+        if wbi_signer.stale:  # 通常已由is_logged_in的nav响应刷新, 跨天运行时才会走到这里
+            wbi_signer.refresh(self.session, HEADERS, self.log)
+        if premium is None:
+            premium = bool(quality) and int(quality) >= PREMIUM_MIN_QN
+        with self.profiler.stage("resolve"):
+            if wbi_signer.ready:
+                resp = self._get(WBI_PLAYURL_URL, premium=premium, params=wbi_signer.sign(params), headers=headers)
+            else:
+                resp = self._get(DOWNLOAD_INFO_RAW_URL, premium=premium, params=params, headers=headers)
+            resp.raise_for_status()
+            return resp.json().get('data') or {}
             
     def print_video_data(self, video_data: dict):
         print(f"""
@@ -123,78 +186,101 @@ class BiliVideoDownloader:
         if download_pages_required.lower() == 'q':
             return []
         
-        download_pages_list: list = download_pages_required.split()
-        
-        for page_number in download_pages_list:
+        page_indexes: list = []
+        for page_number in download_pages_required.split():
             try:
                 page_index = int(page_number) - 1
-                if page_index < 0 or page_index >= len(video_data['pages']):
-                    print(f"输入错误，分P序号{page_number}不存在")
-                    continue
-                    
-                page_data = video_data['pages'][page_index]
-                cid = page_data['cid']
+            except ValueError:
+                print(f"输入错误，分P序号{page_number}不存在")
+                continue
+            if page_index < 0 or page_index >= len(video_data['pages']):
+                print(f"输入错误，分P序号{page_number}不存在")
+                continue
+            page_indexes.append(page_index)
+        
+        if self.quality_policy is not None:
+            self.quality_policy.plan([video_data['pages'][i].get('duration', 0) for i in page_indexes])
+        
+        for page_index in page_indexes:
+            info = self._resolve_page(video_data, bv, page_index)
+            if info:
+                download_info_list.append(info)
                 
-                if video_data['pages_number'] == 1:
-                    referer = f"https://www.bilibili.com/video/{bv}"
-                else:
-                    referer = f"https://www.bilibili.com/video/{bv}?p={page_number}"
-                    
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
-                    "Referer": referer
-                }
+        return download_info_list
+    
+    def _resolve_page(self, video_data: dict, bv: str, page_index: int) -> dict:
+        """获取单个分P的下载信息, 设置了画质策略时自动选择画质"""
+        page_number = page_index + 1
+        try:
+            page_data = video_data['pages'][page_index]
+            cid = page_data['cid']
+            
+            if video_data['pages_number'] == 1:
+                referer = f"https://www.bilibili.com/video/{bv}"
+            else:
+                referer = f"https://www.bilibili.com/video/{bv}?p={page_number}"
                 
-                print(f"\n获取分P{page_number}支持的画质...")
-                resp = self.session.get(
-                    f"https://api.bilibili.com/x/player/playurl?{bv}&cid={cid}",
-                    headers=headers
-                )
-                # print(f"log: {resp.url}")
-                # print(f"log: {resp}")
-                resp.raise_for_status()
-                data = resp.json().get('data', {})
+            headers = {
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
+                "Referer": referer
+            }
+            
+            if self.quality_policy is not None:
+                quality = self._choose_format_by_policy(bv, cid, headers, page_number)
+                if not quality:
+                    return {}
+            else:
+                self.log(f"\n获取分P{page_number}支持的画质...")
+                data = self._playurl(bv, cid, headers)
                 # print(f"log: {data}")
                 if not data:
-                    print(f"分P{page_number}获取画质信息失败")
-                    continue
+                    self.log(f"分P{page_number}获取画质信息失败")
+                    return {}
                     
                 format_list = data.get('support_formats', [])
                 if not format_list:
-                    print(f"分P{page_number}没有可用的画质选项")
-                    continue
-                    
-                print(f"\n为分P{page_number}选择画质:")
-                quality, fmt = self._choose_format(format_list)
-                # print(f"LOG: quality={quality}, fmt={fmt}")
-                print(f"获取分P{page_number}的下载链接...")
-                resp = self.session.get(
-                    f"https://api.bilibili.com/x/player/playurl?{bv}&cid={cid}&qn={quality}",
-                    headers=headers
-                )
-                resp.raise_for_status()
-                data = resp.json().get('data', {})
-                
-                if not data.get('durl'):
-                    print(f"分P{page_number}获取下载链接失败")
-                    continue
+                    self.log(f"分P{page_number}没有可用的画质选项")
+                    return {}
                     
-                download_url = data['durl'][0]['url']
-                
-                download_info_list.append({
-                    'url': download_url,
-                    'quality': quality,
-                    'format': fmt,
-                    'page_index': page_index,
-                    'header': headers,
-                    'page_title': page_data['page_title']
-                })
-                
-            except Exception as e:
-                print(f"处理分P{page_number}时出错: {str(e)}")
-                continue
+                self.log(f"\n为分P{page_number}选择画质:")
+                quality, _ = self._choose_format(format_list)
+            # print(f"LOG: quality={quality}")
+            self.log(f"获取分P{page_number}的下载链接...")
+            data = self._playurl(bv, cid, headers, quality)
+            
+            if not data.get('durl'):
+                self.log(f"分P{page_number}获取下载链接失败")
+                return {}
                 
-        return download_info_list
+            return {
+                'url': data['durl'][0]['url'],
+                'size': data['durl'][0].get('size', 0),
+                'quality': str(data.get('quality', quality)),
+                'format': data.get('format', 'flv')[0:3],
+                'page_index': page_index,
+                'header': headers,
+                'page_title': page_data['page_title']
+            }
+            
+        except Exception as e:
+            self.log(f"处理分P{page_number}时出错: {str(e)}")
+            return {}
+    
+    def _choose_format_by_policy(self, bv: str, cid, headers: dict, page_number: int) -> str:
+        # 普通账号的响应里没有大会员画质, 画质上限允许时用大会员账号获取完整的画质列表
+        max_quality = self.quality_policy.max_quality
+        premium = not max_quality or max_quality >= PREMIUM_MIN_QN
+        data = self._playurl(bv, cid, headers, fnval=FNVAL_DASH_ALL, premium=premium)
+        if not data:
+            self.log(f"分P{page_number}获取画质信息失败")
+            return ""
+        candidate = self.quality_policy.choose(data, self.throughput.bytes_per_second)
+        if candidate is None:
+            self.log(f"分P{page_number}没有可用的画质选项")
+            return ""
+        speed = f"{self.throughput.bytes_per_second / 1024 / 1024:.2f}MB/s" if self.throughput.measured else "未测量"
+        self.log(f"分P{page_number}自动选择画质: qn={candidate.quality} {candidate.codec} 预计 {candidate.size / 1024 / 1024:.1f}MB (当前带宽: {speed})")
+        return str(candidate.quality)
 
     def _choose_format(self, format_list: list) -> tuple[str, str]:
         if not format_list:
@@ -225,39 +311,119 @@ class BiliVideoDownloader:
             print("没有可下载的视频！")
             return
         
-
-        
         for info in download_info_list:
             try:
-                safe_title = re.sub(r'[\\/:*?"<>|]', "", info['page_title'])
-                download_dir = "bilibili_downloads"
-                video_path = os.path.join(download_dir, re.sub(r'[\\/:*?"<>|]', "", video_data['title']), "video")
-                os.makedirs(video_path, exist_ok=True)
-                
-                filename = f"{video_data['title']}_{safe_title}.{info['format']}" if video_data['pages_number'] > 1 else f"{video_data['title']}.{info['format']}"
-                filepath = os.path.join(video_path, unquote(filename))
-                
-                print(f"\n开始下载分P{info['page_index']+1} [{info['quality']} {info['format']}]: {filename}")
+                self._download_page(video_data, info)
+            except Exception as e:
+                self.log(f"下载分P{info['page_index'] + 1}失败: {str(e)}")
+    
+    def _download_page(self, video_data: dict, info: dict, output_dir: str = DOWNLOADS_DIR, progress=None) -> dict:
+        """下载单个分P并返回校验结果; progress为None时显示tqdm进度条, 否则需提供update(n)并支持with"""
+        safe_title = re.sub(r'[\\/:*?"<>|]', "", info['page_title'])
+        video_path = os.path.join(output_dir, re.sub(r'[\\/:*?"<>|]', "", video_data['title']), "video")
+        os.makedirs(video_path, exist_ok=True)
+        
+        remux = self.remux_flv and info['format'] == 'flv'
+        ext = 'mp4' if remux else info['format']
+        filename = f"{video_data['title']}_{safe_title}.{ext}" if video_data['pages_number'] > 1 else f"{video_data['title']}.{ext}"
+        filepath = os.path.join(video_path, unquote(filename))
+        
+        self.log(f"\n开始下载分P{info['page_index']+1} [{info['quality']} {info['format']}{' -> mp4' if remux else ''}]: {filename}")
+        
+        with self.profiler.stage("transfer"), self.session.get(info['url'], headers=info['header'], stream=True,
+                                                                      timeout=TRANSFER_TIMEOUT) as response:
+            response.raise_for_status()
+            total_size = int(response.headers.get('content-length', 0))
+            # durl中的size是服务端给出的完整大小, 优先于content-length
+            verifier = StreamVerifier(int(info.get('size') or 0) or total_size)
+            
+            if remux:
+                writer = RemuxingWriter(filepath, os.path.splitext(filepath)[0] + ".flv", self.log)
+            else:
+                writer = open(filepath, 'wb')
+            if progress is None:
+                progress = tqdm(total=verifier.expected_size or total_size, unit='B', unit_scale=True, unit_divisor=1024)
+            try:
+                with writer as f, progress as pbar:
+                    self._write_stream(response, f, pbar, verifier)
+                    refetched = self._refetch_missing(info, f, pbar, verifier)
+            except DownloadCancelled:
+                output_file = getattr(writer, 'path', filepath)
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                raise
+        
+        output_name = os.path.basename(getattr(writer, 'path', filepath))
+        remuxed = output_name.endswith('.mp4') and remux
+        result = dict(
+            verifier.result(),
+            content_length=total_size,
+            refetched_ranges=refetched,
+            remuxed=remuxed,
+            quality=info['quality'],
+        )
+        if remuxed:
+            # 校验值是按下载的FLV原始数据计算的, 与转换后的MP4文件内容不同
+            result['source_sha256'] = result.pop('sha256')
+            result['source_block_sha256'] = result.pop('block_sha256')
+        with self.profiler.stage("persist"):
+            IntegrityManifest(video_path, self.log).record(output_name, result)
+        if verifier.status in ("ok", "unverified"):
+            self.log(f"下载完成: {output_name}")
+        else:
+            self.log(f"警告: {output_name} 校验失败 ({verifier.status}: {verifier.size}/{verifier.expected_size or '?'} 字节)")
+        return dict(result, path=os.path.join(video_path, output_name))
                 
-                with self.session.get(info['url'], headers=info['header'], stream=True) as response:
+    def _write_stream(self, response, f, pbar, verifier: StreamVerifier) -> None:
+        """写入数据的同时更新校验和带宽统计; 连接中断时返回, 由调用方补齐缺失部分"""
+        window_start, window_bytes = time.monotonic(), 0
+        try:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+                    verifier.update(chunk)
+                    pbar.update(len(chunk))
+                    window_bytes += len(chunk)
+                    elapsed = time.monotonic() - window_start
+                    if elapsed >= 0.5:
+                        self.throughput.update(window_bytes, elapsed)
+                        window_start, window_bytes = time.monotonic(), 0
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            verifier.interrupted = True
+            self.log(f"\n连接中断: {e}")
+    
+    def _refetch_missing(self, info: dict, f, pbar, verifier: StreamVerifier) -> list:
+        """只请求缺失的字节范围并接着写入, 返回补齐过的范围列表"""
+        refetched: list = []
+        for _ in range(MAX_REFETCH):
+            if not verifier.missing and verifier.status != "interrupted":
+                break
+            # 不知道完整大小时请求从断点到末尾的全部数据
+            start, end = verifier.size, (verifier.expected_size - 1 if verifier.expected_size else "")
+            self.log(f"\n数据不完整 ({verifier.size}/{verifier.expected_size or '?'} 字节)，重新获取 {start}-{end}")
+            refetched.append([start, end if end != "" else None])
+            headers = dict(info['header'], Range=f"bytes={start}-{end}")
+            try:
+                with self.session.get(info['url'], headers=headers, stream=True, timeout=30) as response:
                     response.raise_for_status()
-                    total_size = int(response.headers.get('content-length', 0))
-                    
-                    with open(filepath, 'wb') as f, tqdm(
-                        total=total_size, unit='B', unit_scale=True, unit_divisor=1024
-                    ) as pbar:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                pbar.update(len(chunk))
-                
-                print(f"下载完成: {filename}")
-                
+                    if response.status_code != 206:
+                        self.log("服务器不支持断点续传，无法补齐缺失部分")
+                        break
+                    total = response.headers.get('content-range', '').rpartition('/')[2]
+                    if not verifier.expected_size and total.isdigit():
+                        verifier.expected_size = int(total)
+                    verifier.interrupted = False
+                    self._write_stream(response, f, pbar, verifier)
+            except DownloadCancelled:
+                raise
             except Exception as e:
-                print(f"下载分P{info['page_index'] + 1}失败: {str(e)}")
-                
+                self.log(f"重新获取失败: {e}")
+        return refetched
+    
     def run(self):
         self.is_logged_in()
+        if self.account_pool is not None:
+            print(f"已启用账号池, 可用账号: {self.account_pool.check()}/{len(self.account_pool)}")
         while True:
             text: str = input("输入视频BV/URL(输入q退出):\n").strip()
             if text.lower() == 'q':
@@ -267,6 +433,7 @@ class BiliVideoDownloader:
             if not bv:
                 print("输入错误，请重新输入")
                 continue
+            self._reload_cookies_if_changed()
             try:
                 video_data: dict = self._video_data_get(bv)
                 if not video_data:
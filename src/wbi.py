@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import datetime
+import threading
+from hashlib import md5
+from urllib.parse import urlencode
+from typing import Callable, Optional
+
+COOKIES_DIR = "cookies"
+WBI_KEY_FILE = os.path.join(COOKIES_DIR, "wbi_keys.json")
+
+MIXIN_KEY_ENC_TAB = [
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+    61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+    36, 20, 34, 44, 52,
+]
+
+_FILTERED_CHARS = str.maketrans("", "", "!'()*")
+
+
+def get_mixin_key(img_key: str, sub_key: str) -> str:
+    raw = img_key + sub_key
+    return "".join(raw[i] for i in MIXIN_KEY_ENC_TAB)[:32]
+
+
+def _key_from_url(url: str) -> str:
+    return url.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+class WbiSigner:
+    """WBI签名: mixin key缓存在内存和磁盘中, 每天随nav接口的响应刷新"""
+
+    def __init__(self, key_file: str = WBI_KEY_FILE):
+        self.key_file = key_file
+        self.mixin_key: Optional[str] = None
+        self.date: str = ""
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.key_file):
+            return
+        try:
+            with open(self.key_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.mixin_key = get_mixin_key(data["img_key"], data["sub_key"])
+            self.date = data.get("date", "")
+        except Exception:
+            # 缓存损坏时忽略, 下一次nav响应会重新写入
+            self.mixin_key, self.date = None, ""
+
+    @property
+    def ready(self) -> bool:
+        return self.mixin_key is not None
+
+    @property
+    def stale(self) -> bool:
+        return self.date != datetime.date.today().isoformat()
+
+    def update_from_nav(self, nav_response: dict, log: Callable = print) -> None:
+        """从 x/web-interface/nav 的响应中提取img_key/sub_key, 未登录时响应中同样包含"""
+        wbi_img = (nav_response.get("data") or {}).get("wbi_img") or {}
+        img_url, sub_url = wbi_img.get("img_url"), wbi_img.get("sub_url")
+        if not img_url or not sub_url:
+            return
+        img_key, sub_key = _key_from_url(img_url), _key_from_url(sub_url)
+        today = datetime.date.today().isoformat()
+        with self._lock:
+            self.mixin_key = get_mixin_key(img_key, sub_key)
+            self.date = today
+            try:
+                os.makedirs(os.path.dirname(self.key_file) or ".", exist_ok=True)
+                tmp_file = f"{self.key_file}.tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump({"img_key": img_key, "sub_key": sub_key, "date": today}, f)
+                os.replace(tmp_file, self.key_file)
+            except Exception as e:
+                log(f"保存WBI密钥缓存失败: {e}")
+
+    def refresh(self, session, headers: dict, log: Callable = print) -> bool:
+        """缓存过期且没有可复用的nav响应时才调用"""
+        try:
+            response = session.get("https://api.bilibili.com/x/web-interface/nav", headers=headers, timeout=10)
+            self.update_from_nav(response.json(), log)
+        except Exception as e:
+            log(f"获取WBI密钥失败: {e}")
+        return self.ready
+
+    def sign(self, params: dict) -> dict:
+        """返回附带wts和w_rid的新参数字典"""
+        if self.mixin_key is None:
+            raise RuntimeError("WBI密钥未初始化")
+        signed = {k: str(v).translate(_FILTERED_CHARS) for k, v in params.items()}
+        signed["wts"] = str(int(time.time()))
+        signed = dict(sorted(signed.items()))
+        signed["w_rid"] = md5((urlencode(signed) + self.mixin_key).encode()).hexdigest()
+        return signed
+
+
+wbi_signer = WbiSigner()
@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import socket
+import argparse
+import requests
+from video_download import BiliVideoDownloader
+from quality_policy import QualityPolicy
+from integrity import IntegrityManifest
+from coordinator import DEFAULT_PORT, TOKEN_ENV, TOKEN_HEADER, check_relative_path, request_token
+
+DOWNLOADS_DIR = "bilibili_downloads"
+HEARTBEAT_INTERVAL = 5
+IDLE_INTERVAL = 2
+
+
+def _sanitize(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]', "", name)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class DownloadWorker:
+    """从协调器领取任务的下载进程, 多台机器共享同一个输出目录时即可协同下载"""
+
+    def __init__(self, coordinator_url: str, name: str = "", output_dir: str = DOWNLOADS_DIR,
+                 downloader: BiliVideoDownloader = None, token: str = ""):
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.output_dir = output_dir
+        self.downloader = downloader or BiliVideoDownloader()
+        self.api = requests.Session()
+        self.api.headers[TOKEN_HEADER] = request_token(token)
+
+    def _target_path(self, path: str, suffix: str = "") -> str:
+        """任务给出的路径解析后必须仍在输出目录下, 防止写到任意位置"""
+        check_relative_path(path)
+        root = os.path.realpath(self.output_dir)
+        target = os.path.realpath(os.path.join(root, path + suffix))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"输出路径超出输出目录: {path}")
+        return target
+
+    def _call(self, path: str, payload: dict) -> dict:
+        response = self.api.post(f"{self.coordinator_url}{path}", json=payload, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def _resolve(self, task: dict) -> dict:
+        """获取视频信息和每个分P的下载地址"""
+        bv = f"bvid={task['bvid']}"
+        video_data = self.downloader._video_data_get(bv)
+        if not video_data:
+            raise RuntimeError(f"获取视频信息失败: {task['bvid']}")
+        self.downloader.quality_policy = QualityPolicy(max_quality=task.get("qn"))
+        page_indexes = [p - 1 for p in task.get("pages") or range(1, len(video_data["pages"]) + 1)]
+        title = _sanitize(video_data["title"])
+        files = []
+        for page_index in page_indexes:
+            info = self.downloader._resolve_page(video_data, bv, page_index)
+            if not info or not info.get("size"):
+                continue
+            if video_data["pages_number"] > 1:
+                filename = f"{title}_{_sanitize(info['page_title'])}.{info['format']}"
+            else:
+                filename = f"{title}.{info['format']}"
+            files.append({
+                "path": os.path.join(title, "video", filename),
+                "url": info["url"],
+                "size": info["size"],
+                "headers": info["header"],
+                "bvid": task["bvid"],
+                "cid": video_data["pages"][page_index]["cid"],
+                "qn": info["quality"],
+            })
+        return {"files": files}
+
+    def _refresh_url(self, task: dict) -> str:
+        """下载地址过期时用本机账号重新获取"""
+        data = self.downloader._playurl(f"bvid={task['bvid']}", task["cid"], task["headers"], str(task["qn"]))
+        return data["durl"][0]["url"]
+
+    def _download_range(self, lease_id: str, task: dict) -> None:
+        start, end = task["start"], task["end"]
+        if start > end:
+            return
+        part_path = self._target_path(task["path"], ".part")
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        url = task["url"]
+        try:
+            for attempt in range(2):
+                headers = dict(task["headers"], Range=f"bytes={start}-{end}")
+                with self.downloader.session.get(url, headers=headers, stream=True, timeout=30) as response:
+                    if response.status_code in (403, 404) and attempt == 0 and task.get("bvid"):
+                        url = self._refresh_url(task)
+                        continue
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise RuntimeError("服务器不支持Range请求")
+                    self._write_range(lease_id, response, fd, start, end)
+                    return
+        finally:
+            os.close(fd)
+
+    def _write_range(self, lease_id: str, response, fd: int, start: int, end: int) -> None:
+        offset = start
+        last_beat = time.monotonic()
+        for chunk in response.iter_content(chunk_size=65536):
+            if not chunk:
+                continue
+            chunk = chunk[:end - offset + 1]
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            if time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+                beat = self._call("/heartbeat", {"lease_id": lease_id, "progress": offset - start})
+                if not beat.get("ok"):
+                    raise LeaseLost()
+                end = min(end, beat["end"])  # 后半段可能已被其他worker领走
+                last_beat = time.monotonic()
+            if offset > end:
+                return
+        if offset <= end:
+            raise RuntimeError(f"数据不完整: {offset - start}/{end - start + 1} 字节")
+
+    def _finalize(self, path: str, size: int, completed_bytes: int) -> None:
+        """completed_bytes是协调器统计的各段已确认写入的字节数; 稀疏的.part文件大小不能说明中间没有空洞"""
+        part_path = self._target_path(path, ".part")
+        final_path = self._target_path(path)
+        actual = os.path.getsize(part_path)
+        os.replace(part_path, final_path)
+        IntegrityManifest(os.path.dirname(final_path)).record(os.path.basename(final_path), {
+            "status": "ok" if completed_bytes == size and actual == size else "incomplete",
+            "size": actual,
+            "expected_size": size,
+            "completed_bytes": completed_bytes,
+            "distributed": True,
+        })
+        print(f"[{self.name}] 下载完成: {final_path}")
+
+    def run_once(self) -> bool:
+        """领取并执行一个任务; 没有任务时返回False"""
+        reply = self._call("/lease", {"worker": self.name})
+        task = reply.get("task")
+        if task is None:
+            return False
+        lease_id = reply["lease_id"]
+        try:
+            if task["kind"] == "resolve":
+                result = self._resolve(task)
+                self._call("/complete", {"lease_id": lease_id, "result": result})
+                print(f"[{self.name}] 已解析 {task['bvid']}: {len(result['files'])} 个文件")
+            else:
+                self._download_range(lease_id, task)
+                done = self._call("/complete", {"lease_id": lease_id})
+                if done.get("finalize"):
+                    self._finalize(done["path"], done["size"], done["completed_bytes"])
+        except LeaseLost:
+            print(f"[{self.name}] 租约已失效，放弃任务 {task['id']}")
+        except Exception as e:
+            print(f"[{self.name}] 任务失败: {e}")
+            self._call("/fail", {"lease_id": lease_id, "error": str(e)})
+        return True
+
+    def run(self, exit_when_finished: bool = False) -> None:
+        print(f"[{self.name}] 已连接协调器 {self.coordinator_url}")
+        while True:
+            try:
+                if self.run_once():
+                    continue
+                if exit_when_finished and self._call("/lease", {"worker": self.name}).get("finished"):
+                    return
+            except requests.RequestException as e:
+                print(f"[{self.name}] 无法连接协调器: {e}")
+            time.sleep(IDLE_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式下载worker")
+    parser.add_argument("coordinator", nargs="?", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    parser.add_argument("--name", default="")
+    parser.add_argument("--output", default=DOWNLOADS_DIR, help="输出目录, 多台机器需挂载同一目录")
+    parser.add_argument("--exit-when-finished", action="store_true")
+    parser.add_argument("--token", default="", help=f"与协调器相同的token, 也可以通过环境变量{TOKEN_ENV}设置")
+    args = parser.parse_args()
+    DownloadWorker(args.coordinator, args.name, args.output, token=args.token).run(args.exit_when_finished)
+
+
+if __name__ == "__main__":
+    main()